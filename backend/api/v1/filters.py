@@ -1,47 +1,96 @@
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
 from django_filters import rest_framework as django_filters
 from django_filters.rest_framework import FilterSet, filters
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.fulltext import search_recipes
+from recipes.models import (Ingredient, Recipe, RecipesFavorite,
+                            ShoppingCart, Tag)
+from recipes.tagsets import filter_by_tags
 
 
 class IngredientSearchFilter(django_filters.FilterSet):
-    name = django_filters.CharFilter(
-        field_name='name', lookup_expr='icontains')
+    name = django_filters.CharFilter(method='filter_name')
     """
     Фильтр для поиска ингредиентов по имени.
+    Сначала выводятся ингредиенты, название которых начинается
+    с запроса, затем содержащие его.
     """
 
     class Meta:
         model = Ingredient
         fields = ['name']
 
+    def filter_name(self, queryset, name, value):
+        return queryset.filter(name__icontains=value).annotate(
+            is_substring=Case(
+                When(name__istartswith=value, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by('is_substring', 'name')[:settings.INGREDIENT_SEARCH_LIMIT]
+
+
+TAGS_MODES = (
+    ('any', 'Любой из тегов'),
+    ('all', 'Все теги'),
+)
+
 
 class RecipeFilter(FilterSet):
     """
-    Фильтры для сортировки рецептов по тегам, наличию в избранном
-    и наличию в корзине.
+    Фильтры для сортировки рецептов по тегам (tags_mode=any|all),
+    наличию в избранном
+    и наличию в корзине, а также полнотекстовый поиск по названию
+    и описанию с сортировкой по релевантности.
     """
 
     tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
+    )
+    tags_mode = filters.ChoiceFilter(
+        choices=TAGS_MODES,
+        method='filter_tags_mode',
     )
 
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('tags', 'tags_mode', 'author', 'is_favorited',
+                  'is_in_shopping_cart', 'search')
+
+    def filter_tags(self, queryset, name, value):
+        """
+        Отбирает рецепты с любым (tags_mode=any, по умолчанию) или
+        со всеми (tags_mode=all) выбранными тегами по индексу
+        (см. recipes.tagsets), без соединения с тегами и DISTINCT.
+        """
+        if not value:
+            return queryset
+        return filter_by_tags(
+            queryset, value,
+            match_all=self.form.cleaned_data.get('tags_mode') == 'all')
+
+    def filter_tags_mode(self, queryset, name, value):
+        return queryset
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(pk__in=RecipesFavorite.objects.filter(
+                user=self.request.user).values('recipe'))
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(carts__user=self.request.user)
+            return queryset.filter(pk__in=ShoppingCart.objects.filter(
+                user=self.request.user).values('recipe'))
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
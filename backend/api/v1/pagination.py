@@ -1,7 +1,224 @@
+import hashlib
+
 from django.conf import settings
-from rest_framework.pagination import PageNumberPagination
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import (EmptyPage, Page, PageNotAnInteger,
+                                   Paginator)
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import ValidationError as APIValidationError
+from rest_framework.pagination import (Cursor, CursorPagination,
+                                       PageNumberPagination)
+
+
+class LookaheadPage(Page):
+    """Страница, знающая о следующей странице без общего количества."""
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Пагинатор, кеширующий общее количество объектов.
+
+    Количество кешируется на PAGINATION_COUNT_CACHE_TIMEOUT секунд
+    по тексту SQL-запроса с параметрами, то есть отдельно для каждого
+    набора фильтров. Для выборок без условий на PostgreSQL
+    используется оценка планировщика (pg_class.reltuples), если
+    таблица больше PAGINATION_COUNT_ESTIMATE_THRESHOLD строк.
+
+    Поэтому количество только выводится в ответе: существование
+    страницы и следующей за ней проверяются по самим данным - вместе
+    со страницей читается еще один объект.
+    """
+
+    def validate_number(self, number):
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        objects = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not objects and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        return LookaheadPage(
+            objects[:self.per_page], number, self,
+            has_next=len(objects) > self.per_page)
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        timeout = settings.PAGINATION_COUNT_CACHE_TIMEOUT
+        if not isinstance(queryset, QuerySet) or not timeout:
+            return super().count
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = 'pagination-count:{}'.format(
+            hashlib.md5(f'{sql}:{params}'.encode()).hexdigest())
+        count = cache.get(key)
+        if count is None:
+            count = self.estimate_count(queryset)
+            if count is None:
+                count = queryset.count()
+            cache.set(key, count, timeout)
+        return count
+
+    @staticmethod
+    def estimate_count(queryset):
+        """Оценка количества строк таблицы без условий отбора."""
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if (row is None
+                or row[0] < settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD):
+            return None
+        return row[0]
 
 
 class CustomPagination(PageNumberPagination):
     page_size = getattr(settings, 'PAGE_SIZE', 10)
     page_size_query_param = 'limit'
+    django_paginator_class = CachedCountPaginator
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Пагинация рецептов по курсору на паре (pub_date, id).
+
+    Позиция курсора - значения обоих полей крайнего рецепта страницы,
+    а следующая страница отбирается условием (pub_date, id) < позиции
+    по индексу recipe_pub_date_id_idx. Позиции уникальны, поэтому
+    смещение для совпадающих pub_date (как в CursorPagination)
+    не нужно. Не выполняет COUNT(*) и OFFSET, поэтому стоимость
+    страницы не зависит от ее номера.
+    """
+    page_size = getattr(settings, 'PAGE_SIZE', 10)
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+    position_separator = '|'
+
+    def _get_position_from_instance(self, instance, ordering):
+        return self.position_separator.join(
+            str(getattr(instance, field.lstrip('-'))) for field in ordering)
+
+    def filter_after_position(self, queryset, position, reverse):
+        """
+        Рецепты после позиции в порядке обхода. Условие по первому
+        полю отдельно от проверки пары сужает просмотр индекса.
+        """
+        first, second = (field.lstrip('-') for field in self.ordering)
+        values = position.split(self.position_separator)
+        if len(values) != 2:
+            raise NotFound(self.invalid_cursor_message)
+        descending = self.ordering[0].startswith('-') != reverse
+        lookup = 'lt' if descending else 'gt'
+        try:
+            return queryset.filter(**{
+                f'{first}__{lookup}e': values[0],
+            }).filter(
+                Q(**{f'{first}__{lookup}': values[0]})
+                | Q(**{f'{second}__{lookup}': values[1]})
+            )
+        except (ValidationError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Повторяет CursorPagination.paginate_queryset, но отбирает
+        страницу по обоим полям позиции.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = (
+            self.cursor or Cursor(offset=0, reverse=False, position=None))
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            ]
+        queryset = queryset.order_by(*ordering)
+        if current_position is not None:
+            queryset = self.filter_after_position(
+                queryset, current_position, reverse)
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following_position = len(results) > len(self.page)
+        following_position = (
+            self._get_position_from_instance(results[-1], self.ordering)
+            if has_following_position else None)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = has_following_position
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position = following_position
+            self.previous_position = current_position
+        self.display_page_controls = self.has_previous or self.has_next
+        return self.page
+
+
+class RecipePagination(CustomPagination):
+    """
+    Постраничная пагинация рецептов с режимом курсора:
+    при наличии параметра `?cursor=` (в том числе пустого)
+    используется RecipeCursorPagination.
+    """
+    cursor_query_param = 'cursor'
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            if request.query_params.get('search', '').strip():
+                # Курсор задает порядок по дате и несовместим
+                # с сортировкой результатов поиска по релевантности.
+                raise APIValidationError({self.cursor_query_param: [
+                    'Курсорная пагинация не поддерживается '
+                    'вместе с параметром search.']})
+            self.cursor_paginator = RecipeCursorPagination()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,57 @@
+import json
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.utils.datastructures import MultiValueDict
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+
+class FormData(dict):
+    """
+    Поля формы в виде обычного словаря. При слиянии с файлами
+    в Request.data берет по одному файлу на поле, а не списки
+    из MultiValueDict.
+    """
+
+    def copy(self):
+        return FormData(self)
+
+    def update(self, other=(), **kwargs):
+        if isinstance(other, MultiValueDict):
+            other = other.items()
+        super().update(other, **kwargs)
+
+
+class MultiPartJSONParser(MultiPartParser):
+    """
+    Парсер multipart/form-data для рецептов.
+
+    Файлы независимо от размера пишутся во временный файл на диске
+    фрагментами по мере чтения тела запроса и не держатся в памяти.
+    Вложенные поля из json_fields передаются строкой JSON
+    (`ingredients=[{"id": 1, "amount": 10}]`) или, для списков
+    простых значений, повторяющимися полями (`tags=1&tags=2`).
+    """
+    json_fields = ('ingredients', 'tags')
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']._request
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        result = super().parse(stream, media_type, parser_context)
+        data = FormData()
+        for key, values in result.data.lists():
+            if key in self.json_fields:
+                data[key] = self.parse_json_field(key, values)
+            else:
+                data[key] = values[-1]
+        return DataAndFiles(data, result.files)
+
+    @staticmethod
+    def parse_json_field(key, values):
+        try:
+            items = [json.loads(value) for value in values]
+        except ValueError:
+            raise ParseError(f'Поле {key} должно содержать JSON.')
+        if len(items) == 1 and isinstance(items[0], list):
+            return items[0]
+        return items
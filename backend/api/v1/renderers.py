@@ -0,0 +1,91 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+
+from rest_framework.renderers import BaseRenderer
+
+SHOPPING_LIST_HEADER = ('Ингредиент', 'Количество', 'Единицы измерения')
+
+
+class Echo:
+    """
+    Псевдобуфер для csv.writer: возвращает записанную строку,
+    не накапливая ее в памяти.
+    """
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer, ABC):
+    """
+    Базовый рендерер списка покупок.
+    Используется для согласования формата по `?format=` и заголовку
+    Accept, а сам список отдается потоком через метод stream.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict) and 'detail' in data:
+            data = data['detail']
+        return str(data).encode(self.charset)
+
+    @abstractmethod
+    def stream(self, items):
+        """
+        Генератор фрагментов файла.
+        items - итерируемый набор словарей с ключами name, total
+        и measurement_unit.
+        """
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    """Список покупок в формате CSV."""
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, items):
+        writer = csv.writer(Echo())
+        yield writer.writerow(SHOPPING_LIST_HEADER)
+        for item in items:
+            yield writer.writerow([
+                item['name'], item['total'], item['measurement_unit']
+            ])
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    """Список покупок в формате JSON."""
+    media_type = 'application/json'
+    format = 'json'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    def stream(self, items):
+        yield '['
+        separator = ''
+        for item in items:
+            yield separator + json.dumps({
+                'name': item['name'],
+                'amount': item['total'],
+                'measurement_unit': item['measurement_unit'],
+            }, ensure_ascii=False)
+            separator = ','
+        yield ']'
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    """Список покупок в виде простого текста."""
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, items):
+        yield 'Список покупок:\n'
+        for item in items:
+            yield (f'{item["name"]} ({item["measurement_unit"]}) '
+                   f'- {item["total"]}\n')
@@ -1,15 +1,52 @@
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
+from recipes.counters import change_counter
+from recipes.images import RENDITIONS, rendition_url
 from recipes.models import (Ingredient, IngredientInRecipe, Recipe,
                             RecipesFavorite, ShoppingCart, Tag)
+from recipes.tasks import schedule_renditions
 from rest_framework import serializers, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.fields import SerializerMethodField
-from rest_framework.relations import PrimaryKeyRelatedField
 from users.models import Follow, User
 
 
+def get_followed_author_ids(request):
+    """
+    Возвращает множество id авторов, на которых подписан текущий
+    пользователь. Загружается одним запросом и кешируется на объекте
+    запроса, поэтому проверка подписки при выводе любого количества
+    пользователей не обращается к базе повторно.
+    """
+    if not hasattr(request, '_followed_author_ids'):
+        request._followed_author_ids = set(
+            Follow.objects.filter(user=request.user)
+            .values_list('author_id', flat=True)
+        )
+    return request._followed_author_ids
+
+
+def is_subscribed(request, author):
+    """Проверяет подписку текущего пользователя на автора."""
+    if not request or not request.user.is_authenticated:
+        return False
+    return author.id in get_followed_author_ids(request)
+
+
+def get_recipes_limit(request):
+    """
+    Возвращает ограничение числа рецептов автора из параметра
+    recipes_limit или None, если ограничение не задано.
+    """
+    limit = request.query_params.get('recipes_limit')
+    if limit and limit.isdigit():
+        return int(limit)
+    return None
+
+
 class CustomUserCreateSerializer(UserCreateSerializer):
     """
     Сериализатор для создания пользователя.
@@ -58,10 +95,7 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            return Follow.objects.filter(user=user, author=obj).exists()
-        return False
+        return is_subscribed(self.context.get('request'), obj)
 
 
 class FollowSerializer(UserSerializer):
@@ -69,7 +103,7 @@ class FollowSerializer(UserSerializer):
     Сериализатор для работы с подписками пользователя.
     """
     recipes = SerializerMethodField()
-    recipes_count = SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
     is_subscribed = SerializerMethodField(read_only=True)
 
     class Meta:
@@ -105,22 +139,16 @@ class FollowSerializer(UserSerializer):
         return data
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return (
-            user.is_authenticated
-            and Follow.objects.filter(user=user, author=obj).exists()
-        )
-
-    @staticmethod
-    def get_recipes_count(obj):
-        return obj.recipes.count()
+        return is_subscribed(self.context.get('request'), obj)
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[: int(limit)]
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
+        else:
+            recipes = obj.recipes.all()
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit is not None:
+                recipes = recipes[:limit]
         serializer = ShortRecipeSerializer(
             recipes, many=True, read_only=True
         )
@@ -165,29 +193,54 @@ class IngredientAmountSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+class RenditionField(serializers.Field):
+    """
+    Адрес производного изображения рецепта
+    (пока копия не построена - адрес оригинала).
+    """
+
+    def __init__(self, rendition, **kwargs):
+        self.rendition = rendition
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return rendition_url(
+            value, self.rendition, self.context.get('request'))
+
+
 class RecipeListSerializer(serializers.ModelSerializer):
     """
-    Сериализатор для отображения рецептов.
+    Сериализатор для отображения списка рецептов.
+    В image отдается копия для карточки, в images - все копии,
+    пока image_status равен pending, вместо копий отдается оригинал.
     """
 
+    image = RenditionField('card')
+    images = serializers.SerializerMethodField()
     tags = TagSerializer(many=True, read_only=True)
     author = CustomUserSerializer(read_only=True)
-    ingredients = serializers.SerializerMethodField()
+    ingredients = IngredientAmountSerializer(
+        source='amounts', many=True, read_only=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image', 'images',
+                  'image_status', 'text', 'cooking_time')
 
-    @staticmethod
-    def get_ingredients(obj):
-        queryset = IngredientInRecipe.objects.filter(recipe=obj)
-        return IngredientAmountSerializer(queryset, many=True).data
+    def get_images(self, obj):
+        request = self.context.get('request')
+        return {
+            name: rendition_url(obj, name, request) for name in RENDITIONS
+        }
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -195,6 +248,8 @@ class RecipeListSerializer(serializers.ModelSerializer):
             user=request.user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -202,12 +257,21 @@ class RecipeListSerializer(serializers.ModelSerializer):
             user=request.user, recipe=obj).exists()
 
 
+class RecipeDetailSerializer(RecipeListSerializer):
+    """
+    Сериализатор для отображения одного рецепта.
+    В image, как и раньше, отдается оригинал, копии - в images.
+    """
+
+    image = serializers.ImageField(read_only=True)
+
+
 class AddIngredientSerializer(serializers.ModelSerializer):
     """
     Сериализатор для добавления ингредиентов.
     """
 
-    id = PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
@@ -215,6 +279,25 @@ class AddIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
+class RecipeImageField(Base64ImageField):
+    """
+    Изображение рецепта строкой base64 или файлом из multipart-запроса.
+    Загруженному файлу, как и декодированному, дается случайное имя.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, UploadedFile):
+            return super().to_internal_value(data)
+        image = serializers.ImageField.to_internal_value(self, data)
+        extension = image.image.format.lower()
+        if extension == 'jpeg':
+            extension = 'jpg'
+        if extension not in self.ALLOWED_TYPES:
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+        image.name = f'{self.get_file_name(None)}.{extension}'
+        return image
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """
     Сериализатор для добавления рецептов.
@@ -224,7 +307,7 @@ class RecipeSerializer(serializers.ModelSerializer):
         queryset=Tag.objects.all(), many=True)
     ingredients = AddIngredientSerializer(many=True)
     author = CustomUserSerializer(read_only=True)
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
@@ -232,6 +315,20 @@ class RecipeSerializer(serializers.ModelSerializer):
             'id', 'author', 'ingredients', 'tags', 'image',
             'name', 'text', 'cooking_time')
 
+    @staticmethod
+    def validate_ingredients(value):
+        """Заменяет id ингредиентов объектами, загружая их одним запросом."""
+        ingredients = Ingredient.objects.in_bulk(
+            {ingredient['id'] for ingredient in value})
+        for ingredient in value:
+            if ingredient['id'] not in ingredients:
+                raise serializers.ValidationError(
+                    f'Недопустимый первичный ключ "{ingredient["id"]}" - '
+                    'объект не существует.'
+                )
+            ingredient['id'] = ingredients[ingredient['id']]
+        return value
+
     def validate(self, data):
         image = data.get('image')
         if not image:
@@ -281,38 +378,85 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def create_ingredients(ingredients, recipe):
-        for ingredient in ingredients:
-            IngredientInRecipe.objects.create(
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
                 recipe=recipe,
                 ingredient=ingredient['id'],
                 amount=ingredient['amount']
             )
+            for ingredient in ingredients
+        )
 
     @staticmethod
-    def create_tags(tags, recipe):
-        for tag in tags:
-            recipe.tags.add(tag.id)
+    def update_ingredients(ingredients, recipe):
+        """
+        Приводит ингредиенты рецепта к новому списку, изменяя только
+        добавленные, удаленные и изменившиеся записи.
+        """
+        new_amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        current = {
+            amount.ingredient_id: amount for amount in recipe.amounts.all()
+        }
+        removed = current.keys() - new_amounts.keys()
+        if removed:
+            IngredientInRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            obj = current.get(ingredient_id)
+            if obj is not None and obj.amount != amount:
+                obj.amount = amount
+                changed.append(obj)
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
+                recipe=recipe,
+                ingredient_id=ingredient_id,
+                amount=amount
+            )
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in current
+        )
 
+    @transaction.atomic
     def create(self, validated_data):
         author = self.context.get('request').user
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(author=author, **validated_data)
-        self.create_tags(tags, recipe)
+        recipe = Recipe.objects.create(
+            author=author, image_status=Recipe.ImageStatus.PENDING,
+            **validated_data)
+        recipe.tags.add(*tags)
         self.create_ingredients(ingredients, recipe)
+        change_counter(User, author.pk, 'recipes_count', 1)
+        schedule_renditions(recipe)
         return recipe
 
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
-        return RecipeListSerializer(instance, context=context).data
+        instance = (
+            Recipe.objects.with_related()
+            .with_user_flags(request.user)
+            .get(pk=instance.pk)
+        )
+        return RecipeDetailSerializer(instance, context=context).data
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        IngredientInRecipe.objects.filter(recipe=instance).delete()
-        self.create_tags(validated_data.pop('tags'), instance)
-        self.create_ingredients(validated_data.pop('ingredients'), instance)
-        return super().update(instance, validated_data)
+        instance.tags.set(validated_data.pop('tags'))
+        self.update_ingredients(validated_data.pop('ingredients'), instance)
+        image_changed = 'image' in validated_data
+        if image_changed:
+            validated_data['image_status'] = Recipe.ImageStatus.PENDING
+        instance = super().update(instance, validated_data)
+        if image_changed:
+            schedule_renditions(instance)
+        return instance
 
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
@@ -320,6 +464,8 @@ class ShortRecipeSerializer(serializers.ModelSerializer):
     Сериализатор для краткого отображения сведений о рецепте.
     """
 
+    image = RenditionField('thumbnail')
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
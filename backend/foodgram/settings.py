@@ -91,6 +91,49 @@ else:
     raise ValueError('Неподдерживаемое значение DB_ENGINE.'
                      'Используйте "sqlite" или "postgresql".')
 
+# Версии данных для кеша ответов и условных GET-запросов хранятся
+# в кеше (см. recipes.cache), поэтому веб-сервер с несколькими
+# процессами и команды (process_images, import_data) должны
+# использовать общий кеш: redis или file на общем томе. locmem
+# подходит только для одного процесса (разработка и тесты).
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+
+if CACHE_BACKEND == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', BASE_DIR / 'cache'),
+        }
+    }
+elif CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', 'redis://127.0.0.1:6379'),
+        }
+    }
+else:
+    raise ValueError('Неподдерживаемое значение CACHE_BACKEND.'
+                     'Используйте "locmem", "file" или "redis".')
+
+# Условные GET-запросы к рецептам сравнивают версии данных из кеша,
+# поэтому включаются только с общим для всех процессов кешем.
+CONDITIONAL_GET = os.getenv(
+    'CONDITIONAL_GET', str(CACHE_BACKEND != 'locmem')) == 'True'
+if CONDITIONAL_GET and CACHE_BACKEND == 'locmem':
+    raise ValueError('CONDITIONAL_GET требует общего кеша. '
+                     'Используйте CACHE_BACKEND "file" или "redis".')
+
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 3600))
+RESPONSE_CACHE_MAX_AGE = int(os.getenv('RESPONSE_CACHE_MAX_AGE', 60))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -134,6 +177,28 @@ STATICFILES_DIRS = [BASE_DIR / 'api' / 'docs']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Медиафайлы отдает nginx по X-Accel-Redirect из внутреннего location
+# MEDIA_ACCEL_REDIRECT_PREFIX (см. infra/nginx.conf), без nginx - Django.
+# Файлы с именем из хеша содержимого кешируются навсегда (immutable).
+MEDIA_ACCEL_REDIRECT = os.getenv(
+    'MEDIA_ACCEL_REDIRECT', str(not DEBUG)) == 'True'
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+MEDIA_MAX_AGE = int(os.getenv('MEDIA_MAX_AGE', 60 * 60))
+# Файлы без ссылок моложе этого возраста не удаляются ни при
+# освобождении, ни командой cleanup_media (см. recipes.storage).
+MEDIA_ORPHAN_MIN_AGE = int(os.getenv('MEDIA_ORPHAN_MIN_AGE', 60 * 60))
+
+# Медиафайлы именуются хешем содержимого (см. recipes.storage).
+STORAGES = {
+    'default': {
+        'BACKEND': 'recipes.storage.HashedFileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
@@ -165,3 +230,28 @@ AUTH_USER_MODEL = 'users.User'
 
 PAGE_SIZE = int(os.getenv('PAGE_SIZE', 10))
 LIMIT_VALUE = int(os.getenv('LIMIT_VALUE', 1))
+
+# Кеширование общего количества объектов при пагинации (0 - отключено)
+# и порог размера таблицы для оценки количества по статистике PostgreSQL.
+PAGINATION_COUNT_CACHE_TIMEOUT = int(
+    os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', 30))
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(
+    os.getenv('PAGINATION_COUNT_ESTIMATE_THRESHOLD', 100000))
+
+# Поиск ингредиентов: index - индекс в памяти процесса,
+# db - запрос к базе данных (на PostgreSQL использует индекс pg_trgm).
+INGREDIENT_SEARCH_BACKEND = os.getenv('INGREDIENT_SEARCH_BACKEND', 'index')
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+
+# Производные изображения рецептов: формат (WEBP или JPEG) и качество.
+IMAGE_RENDITION_FORMAT = os.getenv('IMAGE_RENDITION_FORMAT', 'WEBP').upper()
+IMAGE_RENDITION_QUALITY = int(os.getenv('IMAGE_RENDITION_QUALITY', 80))
+
+# Построение копий изображений: pool - пул процессов веб-сервера,
+# worker - команда process_images, sync - в процессе запроса.
+IMAGE_PROCESSING = os.getenv('IMAGE_PROCESSING', 'pool')
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+# В режиме pool рецепт, ожидающий обработки дольше этого времени
+# (в секундах), считается потерянным пулом и достается process_images.
+IMAGE_PENDING_TIMEOUT = int(os.getenv('IMAGE_PENDING_TIMEOUT', 300))
@@ -5,14 +5,14 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
+from recipes.views import serve_media
 
 urlpatterns = [
     path('admin/v1/', admin.site.urls),
     path('api/', include('api.v1.urls')),
+    path(f'{settings.MEDIA_URL.lstrip("/")}<path:path>', serve_media,
+         name='media'),
 ]
-urlpatterns += static(
-    settings.MEDIA_URL, document_root=settings.MEDIA_ROOT
-)
 urlpatterns += static(
     settings.STATIC_URL, document_root=settings.STATIC_ROOT
 )
@@ -1,10 +1,12 @@
 from django.contrib import admin
-from django.contrib.admin import display
 from django.contrib.auth.models import Group
+from django.utils import timezone
 from rest_framework.authtoken.models import TokenProxy
 
+from .cache import bump_version
 from .models import (Ingredient, IngredientInRecipe, Recipe, RecipesFavorite,
                      ShoppingCart, Tag)
+from .tasks import schedule_renditions
 
 
 @admin.register(Tag)
@@ -28,15 +30,25 @@ class IngredientInRecipeInline(admin.TabularInline):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'favorites_count', 'pub_date')
+    list_display = ('name', 'author', 'favorites_count', 'carts_count',
+                    'pub_date')
     list_filter = ('author', 'name', 'tags')
     search_fields = ('name', 'author__username')
     date_hierarchy = 'pub_date'
     inlines = [IngredientInRecipeInline]
 
-    @display(description='Количество добавлений в избранное')
-    def favorites_count(self, obj):
-        return obj.favorites.count()
+    def save_model(self, request, obj, form, change):
+        image_changed = 'image' in form.changed_data and obj.image
+        if image_changed:
+            obj.image_status = Recipe.ImageStatus.PENDING
+        super().save_model(request, obj, form, change)
+        if image_changed:
+            schedule_renditions(obj)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Ингредиенты из встроенной формы сохраняются после рецепта.
+        bump_version('recipes')
 
 
 @admin.register(IngredientInRecipe)
@@ -44,6 +56,21 @@ class IngredientInRecipeAdmin(admin.ModelAdmin):
     list_display = ('id', 'ingredient', 'recipe', 'amount')
     empty_value_display = '-пусто-'
 
+    @staticmethod
+    def touch_recipe(obj):
+        """Обновляет дату изменения и версию рецептов."""
+        Recipe.objects.filter(pk=obj.recipe_id).update(
+            updated_at=timezone.now())
+        bump_version('recipes')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self.touch_recipe(obj)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.touch_recipe(obj)
+
 
 @admin.register(RecipesFavorite)
 class RecipeFavoriteAdmin(admin.ModelAdmin):
@@ -0,0 +1,186 @@
+"""Кеширование ответов и условные GET-запросы.
+
+Для редко изменяемых справочников ответы кешируются целиком.
+
+Каждому набору данных (справочнику, рецептам, избранному, корзине
+и подпискам одного пользователя) соответствует счетчик версии в кеше.
+Ключ ответа и ETag включают текущую версию, поэтому изменение данных
+(сигналы post_save/post_delete, представления или импорт) сразу
+делает все ранее закешированные ответы недействительными, а старые
+записи вытесняются по таймауту. Версия - время последнего изменения
+в наносекундах, поэтому по ней же вычисляется Last-Modified.
+Для нескольких процессов gunicorn используйте общий бэкенд кеша
+(file или redis), иначе каждый процесс хранит свою версию.
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def user_namespace(user_id) -> str:
+    """Набор данных пользователя: избранное, корзина и подписки."""
+    return f'user:{user_id}'
+
+
+def get_version(namespace: str) -> int:
+    """Возвращает текущую версию данных справочника."""
+    cache = get_cache()
+    key = f'{namespace}:version'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(namespaces) -> list[int]:
+    """Возвращает версии нескольких наборов данных одним запросом к кешу."""
+    keys = {namespace: f'{namespace}:version' for namespace in namespaces}
+    versions = get_cache().get_many(keys.values())
+    return [
+        versions[key] if key in versions else get_version(namespace)
+        for namespace, key in keys.items()
+    ]
+
+
+def bump_version(namespace: str) -> None:
+    """
+    Обновляет версию справочника, сбрасывая закешированные ответы.
+    Новая версия - текущее время, но не меньше предыдущей версии + 1.
+    """
+    cache = get_cache()
+    key = f'{namespace}:version'
+    version = cache.get(key) or 0
+    cache.set(key, max(time.time_ns(), version + 1), timeout=None)
+
+
+class VersionedCacheMixin:
+    """
+    Миксин для ReadOnlyModelViewSet: кеширует list и retrieve
+    с учетом параметров запроса и отвечает 304 на If-None-Match.
+    """
+    cache_namespace = None
+
+    def get_cache_key(self, request, action, kwargs):
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        lookup = urlencode(sorted(kwargs.items()))
+        return (f'{action}:{lookup}:{query}:'
+                f'{request.accepted_renderer.format}')
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        version = get_version(self.cache_namespace)
+        key = self.get_cache_key(request, self.action, kwargs)
+        etag = '"{}"'.format(hashlib.md5(
+            f'{self.cache_namespace}:{version}:{key}'.encode()
+        ).hexdigest())
+        headers = {
+            'ETag': etag,
+            'Cache-Control': (
+                f'public, max-age={settings.RESPONSE_CACHE_MAX_AGE}'),
+        }
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers=headers)
+
+        cache = get_cache()
+        cache_key = f'{self.cache_namespace}:{version}:{key}'
+        data = cache.get(cache_key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            data = response.data
+            cache.set(cache_key, data, settings.RESPONSE_CACHE_TIMEOUT)
+        return Response(data, headers=headers)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super().retrieve, *args, **kwargs)
+
+
+class ConditionalGetMixin:
+    """
+    Миксин для условных GET-запросов к list и retrieve.
+
+    ETag и Last-Modified вычисляются без обращения к базе данных
+    из версий conditional_namespaces, а для авторизованного
+    пользователя - еще и из версии его избранного, корзины и подписок
+    (user_namespace). Поэтому они учитывают удаления и изменения
+    связанных объектов, а ответ 304 на If-None-Match или
+    If-Modified-Since отдается без запросов к базе. Версии верны,
+    только если кеш общий для всех процессов, иначе (CONDITIONAL_GET
+    выключен) ответы отдаются без валидаторов.
+    """
+    conditional_namespaces = ()
+
+    def conditional_response(self, request, handler, lookup, *args,
+                             **kwargs):
+        if not settings.CONDITIONAL_GET:
+            return handler(request, *args, **kwargs)
+        user = request.user
+        namespaces = list(self.conditional_namespaces)
+        if user.is_authenticated:
+            namespaces.append(user_namespace(user.pk))
+        versions = get_versions(namespaces)
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        etag = '"{}"'.format(hashlib.md5(
+            f'{self.action}:{lookup}:{query}:{user.pk}:'
+            f'{request.accepted_renderer.format}:{versions}'.encode()
+        ).hexdigest())
+        last_modified = max(versions) // 10 ** 9
+        headers = {
+            'ETag': etag,
+            'Cache-Control': (
+                'private, no-cache' if user.is_authenticated
+                else 'public, no-cache'),
+        }
+        # Изменение в ту же секунду не поменяло бы Last-Modified,
+        # поэтому заголовок отдается, только когда эта секунда прошла.
+        if last_modified < int(time.time()):
+            headers['Last-Modified'] = http_date(last_modified)
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            not_modified = etag in [
+                tag.strip() for tag in if_none_match.split(',')]
+        else:
+            if_modified_since = parse_http_date_safe(
+                request.headers.get('If-Modified-Since', ''))
+            not_modified = (
+                'Last-Modified' in headers
+                and if_modified_since is not None
+                and last_modified <= if_modified_since
+            )
+        if not_modified:
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers=headers)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            for header, value in headers.items():
+                response[header] = value
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, super().list, {}, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        lookup = {self.lookup_field: kwargs[lookup_url_kwarg]}
+        return self.conditional_response(
+            request, super().retrieve, lookup, *args, **kwargs)
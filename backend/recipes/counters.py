@@ -0,0 +1,58 @@
+"""Денормализованные счетчики рецептов и пользователей.
+
+Счетчики изменяются атомарно выражениями F() в представлениях,
+добавляющих и удаляющих избранное, корзину, подписки и рецепты.
+Изменения в обход API (админка, массовая загрузка) исправляются
+командой `python manage.py recalculate_counters`.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from users.models import Follow, User
+
+from .models import Recipe, RecipesFavorite, ShoppingCart
+
+COUNTERS = (
+    (Recipe, 'favorites_count', RecipesFavorite, 'recipe'),
+    (Recipe, 'carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def change_counter(model, pk, field, delta):
+    """Изменяет счетчик объекта на delta, не опуская его ниже нуля."""
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)})
+
+
+def actual_count(related_model, related_field):
+    """Подзапрос, считающий связанные объекты для OuterRef('pk')."""
+    return Coalesce(
+        Subquery(
+            related_model.objects
+            .filter(**{related_field: OuterRef('pk')})
+            .order_by()
+            .values(related_field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+def recalculate_counters():
+    """
+    Пересчитывает все счетчики, обновляя только расходящиеся записи.
+    Возвращает словарь количества исправленных записей по счетчикам.
+    """
+    fixed = {}
+    for model, field, related_model, related_field in COUNTERS:
+        actual = actual_count(related_model, related_field)
+        stale = (
+            model.objects.annotate(actual=actual)
+            .exclude(**{field: F('actual')})
+            .values('pk')
+        )
+        fixed[f'{model.__name__}.{field}'] = model.objects.filter(
+            pk__in=stale).update(**{field: actual})
+    return fixed
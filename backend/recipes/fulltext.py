@@ -0,0 +1,104 @@
+"""Полнотекстовый поиск рецептов по названию и описанию.
+
+На PostgreSQL поисковый документ - генерируемый столбец
+recipes_recipe.search_document типа tsvector (конфигурация russian,
+название весомее описания) с GIN-индексом; база обновляет его сама
+при любой записи. Запрос разбирается websearch_to_tsquery,
+результаты сортируются по ts_rank_cd.
+
+На SQLite документ хранится в таблице FTS5 recipes_recipe_fts,
+которую обновляют сигналы post_save и post_delete рецепта. Русского
+стемминга в SQLite нет, поэтому каждое слово запроса ищется
+как префикс, а результаты сортируются по bm25. Буква «ё» в документе
+и запросе заменяется на «е».
+
+Таблицу и столбец создает миграция 0012_recipe_search.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'recipes_recipe_fts'
+# Веса названия и описания для bm25.
+BM25_WEIGHTS = (10.0, 1.0)
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(value):
+    """Заменяет «ё» на «е»: токенизатор FTS5 их различает."""
+    return value.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def fts5_query(query):
+    """Строка запроса FTS5: все слова запроса как префиксы."""
+    return ' '.join(
+        f'"{word}"*' for word in WORD_RE.findall(normalize(query)))
+
+
+def search_recipes(queryset, query):
+    """
+    Отбирает рецепты, подходящие под поисковый запрос, и сортирует
+    их по релевантности, а при равной релевантности - по дате.
+    """
+    query = query.strip()
+    if not query:
+        return queryset
+    table = queryset.model._meta.db_table
+    ordering = queryset.model._meta.ordering
+    if connection.vendor == 'postgresql':
+        tsquery = "websearch_to_tsquery('russian', %s)"
+        return queryset.filter(RawSQL(
+            f'{table}.search_document @@ {tsquery}', [query],
+            output_field=BooleanField(),
+        )).annotate(search_rank=RawSQL(
+            f'ts_rank_cd({table}.search_document, {tsquery})', [query],
+            output_field=FloatField(),
+        )).order_by('-search_rank', *ordering)
+    if connection.vendor == 'sqlite':
+        match = fts5_query(query)
+        if not match:
+            return queryset.none()
+        weights = ', '.join(map(str, BM25_WEIGHTS))
+        return queryset.filter(RawSQL(
+            f'{table}.id IN (SELECT rowid FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s)', [match],
+            output_field=BooleanField(),
+        )).annotate(search_rank=RawSQL(
+            f'(SELECT bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id)', [match],
+            output_field=FloatField(),
+        )).order_by('search_rank', *ordering)
+    raise NotImplementedError(
+        f'Полнотекстовый поиск не поддерживается для {connection.vendor}.')
+
+
+def index_recipe(recipe):
+    """Обновляет поисковый документ рецепта в таблице FTS5 (SQLite)."""
+    index_recipes([recipe])
+
+
+def index_recipes(recipes):
+    """
+    Обновляет поисковые документы рецептов одним запросом (SQLite),
+    например после bulk_create, при котором сигналы не отправляются.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'REPLACE INTO {FTS_TABLE} (rowid, name, text) '
+            'VALUES (%s, %s, %s)',
+            [(recipe.pk, normalize(recipe.name), normalize(recipe.text))
+             for recipe in recipes])
+
+
+def unindex_recipe(recipe_id):
+    """Удаляет поисковый документ рецепта из таблицы FTS5 (SQLite)."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [recipe_id])
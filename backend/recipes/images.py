@@ -0,0 +1,156 @@
+"""Производные изображения рецептов.
+
+При загрузке изображения из оригинала строятся уменьшенные копии
+фиксированных размеров (RENDITIONS) в формате IMAGE_RENDITION_FORMAT.
+Копии сохраняются без метаданных (EXIF, цветовой профиль), а пути
+к ним хранятся в поле Recipe.renditions. Пока копии не построены,
+вместо них отдается оригинал.
+
+Функции render и render_all не обращаются к Django и выполняются
+в процессах пула (см. recipes.tasks).
+"""
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from .storage import release_file, update_references
+
+# Имя копии: (ширина, высота, обрезать до точного размера).
+RENDITIONS = {
+    'thumbnail': (160, 160, True),
+    'card': (600, 400, False),
+    'full': (1600, 1600, False),
+}
+RENDITIONS_DIR = 'renditions'
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def get_format():
+    """Возвращает формат копий, откатываясь на JPEG без поддержки WebP."""
+    if settings.IMAGE_RENDITION_FORMAT == 'WEBP' and features.check('webp'):
+        return 'WEBP'
+    return 'JPEG'
+
+
+def render(file, width, height, crop, image_format, quality):
+    """Строит одну копию изображения и возвращает ее байты."""
+    with Image.open(file) as source:
+        image = ImageOps.exif_transpose(source)
+        if crop:
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            image.thumbnail((width, height), Image.LANCZOS)
+        if image_format == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, 'white')
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            else:
+                image = image.convert('RGB')
+        image.info.clear()
+        buffer = BytesIO()
+        image.save(buffer, image_format, quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def render_all(source, image_format, quality):
+    """Строит все копии из оригинала: пути к файлу или его байтов."""
+    return {
+        name: render(
+            BytesIO(source) if isinstance(source, bytes) else source,
+            width, height, crop, image_format, quality)
+        for name, (width, height, crop) in RENDITIONS.items()
+    }
+
+
+def read_original(recipe):
+    """Читает байты оригинального изображения рецепта."""
+    with recipe.image.open('rb') as file:
+        return file.read()
+
+
+def original_source(recipe):
+    """
+    Оригинал для render_all: путь к файлу, который процесс пула
+    прочитает сам, а если хранилище не локальное - байты файла.
+    """
+    try:
+        return recipe.image.path
+    except NotImplementedError:
+        return read_original(recipe)
+
+
+def save_renditions(recipe, contents, image_format):
+    """
+    Сохраняет построенные копии в хранилище и отмечает их готовыми.
+    Если изображение рецепта успели заменить, копии удаляются.
+    """
+    from .cache import bump_version
+    from .models import Recipe
+
+    storage = recipe.image.storage
+    stem = PurePosixPath(recipe.image.name).stem
+    extension = EXTENSIONS[image_format]
+    renditions = {
+        name: storage.save(
+            f'{RENDITIONS_DIR}/{name}/{stem}.{extension}',
+            ContentFile(content))
+        for name, content in contents.items()
+    }
+    current = Recipe.objects.filter(pk=recipe.pk, image=recipe.image.name)
+    old = current.values_list('renditions', flat=True).first()
+    updated = current.update(
+        renditions=renditions,
+        image_status=Recipe.ImageStatus.READY,
+        updated_at=timezone.now(),
+    )
+    if updated:
+        recipe.renditions = renditions
+        recipe.image_status = Recipe.ImageStatus.READY
+        update_references(recipe)
+        bump_version('recipes')
+    delete_renditions(old if updated else renditions, storage)
+    return renditions
+
+
+def mark_failed(recipe):
+    """Отмечает, что копии изображения построить не удалось."""
+    from .cache import bump_version
+    from .models import Recipe
+
+    Recipe.objects.filter(pk=recipe.pk, image=recipe.image.name).update(
+        image_status=Recipe.ImageStatus.FAILED, updated_at=timezone.now())
+    bump_version('recipes')
+    recipe.image_status = Recipe.ImageStatus.FAILED
+
+
+def delete_renditions(renditions, storage):
+    """Удаляет файлы копий, на которые больше не ссылаются рецепты."""
+    for name in (renditions or {}).values():
+        release_file(name, storage)
+
+
+def generate_renditions(recipe):
+    """Строит и сохраняет все копии изображения рецепта в текущем процессе."""
+    image_format = get_format()
+    contents = render_all(
+        read_original(recipe), image_format,
+        settings.IMAGE_RENDITION_QUALITY)
+    return save_renditions(recipe, contents, image_format)
+
+
+def rendition_url(recipe, name, request=None):
+    """Адрес готовой копии изображения, а иначе - адрес оригинала."""
+    path = recipe.renditions.get(name)
+    if path and recipe.image_status == recipe.ImageStatus.READY:
+        url = recipe.image.storage.url(path)
+    elif recipe.image:
+        url = recipe.image.url
+    else:
+        return None
+    return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,52 @@
+"""Удаление медиафайлов, на которые не ссылается ни один рецепт.
+
+Запускается из директории backend
+командой `python manage.py cleanup_media`.
+Файлы моложе --min-age секунд не удаляются: они могут принадлежать
+рецепту, транзакция которого еще не зафиксирована.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from recipes.storage import referenced_files
+
+
+class Command(BaseCommand):
+    """Класс очистки неиспользуемых медиафайлов."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=settings.MEDIA_ORPHAN_MIN_AGE,
+            help='Минимальный возраст удаляемого файла, в секундах.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только вывести файлы, которые будут удалены.',
+        )
+
+    def handle(self, *args, **options):
+        if options['min_age'] < 0:
+            raise CommandError('--min-age не может быть отрицательным.')
+        root = str(settings.MEDIA_ROOT)
+        referenced = referenced_files()
+        deadline = time.time() - options['min_age']
+        removed = size = 0
+        for directory, _, files in os.walk(root):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                if name in referenced or os.path.getmtime(path) > deadline:
+                    continue
+                size += os.path.getsize(path)
+                removed += 1
+                if options['dry_run']:
+                    print(name)
+                else:
+                    os.remove(path)
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        print(f'{action} {removed} файлов, {size} байт.')
@@ -3,16 +3,32 @@
 Настроен импорт ингредиентов из папки data.
 Запускается из директории backend
 командой `python manage.py import_data`.
+
+Файл с ингредиентами можно указать явно:
+`python manage.py import_data --path catalog.json --format json
+--batch-size 5000 --workers 4`. Файлы читаются потоково, поэтому
+размер каталога ограничен только местом на диске.
 """
 import csv
+import io
 import json
 import os
-from typing import Any
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import IO, Any, Callable, Iterable, Iterator
 
-from django.core.management import BaseCommand
-from django.db import IntegrityError
+from django.core.management import BaseCommand, CommandError
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from recipes.cache import bump_version
 from recipes.models import Ingredient, Tag
 
+BATCH_SIZE = 1000
+JSON_CHUNK_SIZE = 64 * 1024
+FILE_TYPES = ('csv', 'json')
+SEPARATORS = re.compile(r'[\s,]*')
+
 FILES_CLASSES: dict[str, type] = {
     'ingredients': Ingredient,
 }
@@ -23,26 +39,30 @@ FIELDS: dict[str, tuple[str, type]] = {
 }
 
 
-def get_file_type(file_name: str, project_root: str) -> str | None:
-    """Определяет формат файла для загрузки."""
+def get_file_type(
+    file_name: str,
+    project_root: str,
+    preferred: str | None = None
+) -> str | None:
+    """Определяет формат файла для загрузки без участия пользователя.
+
+    Если найдены оба файла и формат не задан параметром --format,
+    загружается CSV.
+    """
     csv_path = os.path.join(project_root, 'data', f'{file_name}.csv')
     json_path = os.path.join(project_root, 'data', f'{file_name}.json')
 
     csv_exists = os.path.isfile(csv_path)
     json_exists = os.path.isfile(json_path)
 
+    if preferred == 'csv':
+        return 'csv' if csv_exists else None
+    if preferred == 'json':
+        return 'json' if json_exists else None
     if csv_exists and json_exists:
         print(f'Найдены два файла данных: {file_name}.csv и {file_name}.json')
-        print('Выберите, файл какого формата загрузить:')
-        print('1 - CSV')
-        print('2 - JSON')
-        while True:
-            choice = input('Введите номер (1 или 2): ').strip()
-            if choice == '1':
-                return 'csv'
-            elif choice == '2':
-                return 'json'
-            print('Неверный выбор. Введите 1 или 2.')
+        print('Загружается CSV, для выбора JSON укажите --format json.')
+        return 'csv'
     elif csv_exists:
         return 'csv'
     elif json_exists:
@@ -87,63 +107,204 @@ def change_foreign_values(data: dict[str, Any]) -> dict[str, Any]:
     return data_copy
 
 
+def iter_json_array(
+    file: IO[str],
+    chunk_size: int = JSON_CHUNK_SIZE
+) -> Iterator[Any]:
+    """Инкрементально разбирает JSON-массив, возвращая его элементы.
+
+    В памяти держится только текущий фрагмент файла, а не весь массив.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while not buffer.strip():
+        chunk = file.read(chunk_size)
+        if not chunk:
+            raise ValueError('Ожидается JSON-массив.')
+        buffer += chunk
+    buffer = buffer.lstrip()
+    if buffer[0] != '[':
+        raise ValueError('Ожидается JSON-массив.')
+    position = 1
+    eof = False
+
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            end = None
+        if end is None or (end == len(buffer) and not eof):
+            if eof:
+                raise ValueError('Некорректный JSON-массив.')
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item
+        position = end
+
+
+def read_rows(file_path: str, file_type: str) -> Iterator[dict[str, Any]]:
+    """Построчно читает записи из файла, не загружая его целиком."""
+    with open(file_path, encoding='utf-8', newline='') as file:
+        if file_type == 'csv':
+            yield from csv.DictReader(file)
+        elif file_type == 'json':
+            for item in iter_json_array(file):
+                if isinstance(item, dict):
+                    yield item
+
+
+def parse_rows(
+    rows: Iterable[dict[str, Any]]
+) -> Iterator[tuple[str, str]]:
+    """Приводит записи файла к парам (название, единица измерения)."""
+    for row in rows:
+        item = change_foreign_values(row)
+        yield item['name'], item.get('measurement_unit', '')
+
+
+def batched(
+    iterable: Iterable[tuple[str, str]],
+    size: int,
+    stats: dict[str, int]
+) -> Iterator[list[tuple[str, str]]]:
+    """
+    Разбивает поток записей на пачки заданного размера, отбрасывая
+    повторы внутри пачки. Повторы между пачками и уже загруженные
+    записи отбрасывает база данных при вставке.
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        unique = list(dict.fromkeys(batch))
+        stats['skipped'] += len(batch) - len(unique)
+        yield unique
+
+
+def bulk_insert(class_name: type, batch: list[tuple[str, str]]) -> int:
+    """
+    Вставляет пачку записей с ON CONFLICT DO NOTHING и возвращает
+    количество вставленных строк.
+    """
+    table = connection.ops.quote_name(class_name._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            'VALUES (%s, %s) ON CONFLICT DO NOTHING',
+            batch,
+        )
+        return cursor.rowcount
+
+
+def copy_insert(class_name: type, batch: list[tuple[str, str]]) -> int:
+    """
+    Вставляет пачку записей через COPY FROM STDIN во временную таблицу
+    с последующим INSERT ... ON CONFLICT DO NOTHING (только PostgreSQL).
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+    table = connection.ops.quote_name(class_name._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS import_buffer '
+            '(name varchar(200), measurement_unit varchar(200)) '
+            'ON COMMIT DROP'
+        )
+        cursor.execute('TRUNCATE import_buffer')
+        cursor.copy_expert(
+            'COPY import_buffer (name, measurement_unit) '
+            'FROM STDIN WITH (FORMAT csv)',
+            buffer,
+        )
+        cursor.execute(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            'SELECT name, measurement_unit FROM import_buffer '
+            'ON CONFLICT DO NOTHING'
+        )
+        return cursor.rowcount
+
+
+def insert_in_thread(
+    insert: Callable[[type, list[tuple[str, str]]], int],
+    class_name: type,
+    batch: list[tuple[str, str]]
+) -> int:
+    """Вставляет пачку в отдельной транзакции рабочего потока."""
+    try:
+        with transaction.atomic():
+            return insert(class_name, batch)
+    finally:
+        connection.close()
+
+
 def load_data(
-    file_name: str,
+    file_path: str,
     class_name: type,
     file_type: str,
-    project_root: str
+    batch_size: int = BATCH_SIZE,
+    workers: int = 1
 ) -> None:
     """Загружает данные ингредиентов из файлов ingredients.json или
-    ingredients.csv."""
+    ingredients.csv.
+
+    Файл читается потоково и вставляется пачками, дубликаты и уже
+    существующие записи отбрасывает база данных по уникальному
+    ограничению, поэтому память не зависит от размера каталога.
+    При workers > 1 пачки вставляются параллельно в отдельных
+    соединениях, в памяти одновременно находится не больше
+    2 * workers пачек. Повторный запуск ничего не изменяет.
+    """
+    file_name = os.path.basename(file_path)
     table_not_loaded = (f'Информация в таблицу'
                         f'{class_name.__qualname__} не загружена.')
     table_loaded = f'Информация в таблицу {class_name.__qualname__} загружена.'
-    data = open_data_file(file_name, file_type, project_root)
-
-    if data is None:
-        print(f'Пропуск загрузки данных для {file_name}.{file_type}')
+    insert = (
+        copy_insert if connection.vendor == 'postgresql' else bulk_insert
+    )
+    if connection.vendor == 'sqlite' and workers > 1:
+        print('SQLite не поддерживает параллельную запись, workers = 1.')
+        workers = 1
+    stats = {'inserted': 0, 'skipped': 0}
+    rows = read_rows(file_path, file_type)
+    batches = batched(parse_rows(rows), batch_size, stats)
+    try:
+        if workers == 1:
+            with transaction.atomic():
+                for batch in batches:
+                    inserted = insert(class_name, batch)
+                    stats['inserted'] += inserted
+                    stats['skipped'] += len(batch) - inserted
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                for batch in batches:
+                    if len(pending) >= 2 * workers:
+                        size, future = pending.popleft()
+                        inserted = future.result()
+                        stats['inserted'] += inserted
+                        stats['skipped'] += size - inserted
+                    pending.append((len(batch), executor.submit(
+                        insert_in_thread, insert, class_name, batch)))
+                for size, future in pending:
+                    inserted = future.result()
+                    stats['inserted'] += inserted
+                    stats['skipped'] += size - inserted
+    except FileNotFoundError:
+        print(f'Файл {file_name} не найден.')
+        print(f'Пропуск загрузки данных для {file_name}')
+        return
+    except (ValueError, KeyError, DatabaseError) as error:
+        print(f'Ошибка в загружаемых данных.'
+              f'{error}. {table_not_loaded}')
         return
 
-    loaded_count = 0
-    if file_type == 'csv':
-        rows = data
-        header = rows[0]
-        for row in rows[1:]:
-            data_csv = change_foreign_values(
-                {key: value for key, value in zip(header, row)})
-            try:
-                _, created = class_name.objects.get_or_create(
-                    name=data_csv['name'],
-                    measurement_unit=data_csv.get('measurement_unit', ''),
-                    defaults=data_csv
-                )
-                if created:
-                    loaded_count += 1
-            except (ValueError, IntegrityError) as error:
-                print(
-                    f'Ошибка в загружаемых данных.'
-                    f'{error}. {table_not_loaded}')
-                break
-    elif file_type == 'json':
-        for item in data:
-            if not isinstance(item, dict):
-                continue
-            item = change_foreign_values(item)
-            try:
-                _, created = class_name.objects.get_or_create(
-                    name=item['name'],
-                    measurement_unit=item.get('measurement_unit', ''),
-                    defaults=item
-                )
-                if created:
-                    loaded_count += 1
-            except (ValueError, IntegrityError) as error:
-                print(
-                    f'Ошибка в загружаемых данных.'
-                    f'{error}. {table_not_loaded}')
-                break
-
-    print(f'Загружено {loaded_count} записей.')
+    print(f'Загружено {stats["inserted"]} записей, '
+          f'пропущено {stats["skipped"]}.')
     print(table_loaded)
 
 
@@ -159,37 +320,85 @@ def load_tags(project_root: str) -> None:
         print(f'Пропуск загрузки данных для {file_name}.{file_type}')
         return
 
-    loaded_count = 0
     tags_data: list[dict[str, Any]] = [
         item for item in data if isinstance(item, dict)
     ]
+    existing = set(class_name.objects.values_list('slug', flat=True))
+    new_tags = []
     for item in tags_data:
-        try:
-            _, created = class_name.objects.get_or_create(
-                slug=item['slug'],
-                defaults=item
-            )
-            if created:
-                print(f'Тег {item["name"]} загружен.')
-                loaded_count += 1
-        except (ValueError, IntegrityError) as error:
-            print(f'Ошибка в загружаемых данных. {error}.')
-            break
-
-    print(f'Загружено {loaded_count} тегов.')
+        if item.get('slug') in existing:
+            continue
+        existing.add(item.get('slug'))
+        new_tags.append(class_name(**item))
+    try:
+        class_name.assign_masks(new_tags)
+        class_name.objects.bulk_create(new_tags, ignore_conflicts=True)
+    except (ValueError, TypeError, IntegrityError) as error:
+        print(f'Ошибка в загружаемых данных. {error}.')
+        return
+    if new_tags:
+        bump_version('tags')
+    for tag in new_tags:
+        print(f'Тег {tag.name} загружен.')
+
+    print(f'Загружено {len(new_tags)} тегов.')
     print(f'Информация в таблицу {class_name.__qualname__} загружена.')
 
 
 class Command(BaseCommand):
     """Класс загрузки информации в базу данных."""
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=FILE_TYPES,
+            help='Формат файла ингредиентов. По умолчанию определяется '
+                 'по расширению файла, при наличии обоих файлов - CSV.',
+        )
+        parser.add_argument(
+            '--path',
+            help='Путь к файлу ингредиентов вместо data/ingredients.*.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Количество записей, вставляемых одним запросом.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Количество потоков, параллельно вставляющих пачки.',
+        )
+
     def handle(self, *args, **options):
         project_root = os.getcwd()
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError(
+                '--batch-size и --workers должны быть положительными.')
         for key, value in FILES_CLASSES.items():
             print(f'Загрузка информации в таблицу {value.__qualname__}')
-            file_type = get_file_type(key, project_root)
+            if options['path']:
+                file_path = options['path']
+                file_type = (
+                    options['format']
+                    or os.path.splitext(file_path)[1].lstrip('.').lower()
+                )
+                if file_type not in FILE_TYPES:
+                    raise CommandError(
+                        f'Неизвестный формат файла {file_path}, '
+                        'укажите --format.')
+            else:
+                file_type = get_file_type(
+                    key, project_root, options['format'])
+                file_path = os.path.join(
+                    project_root, 'data', f'{key}.{file_type}')
             if file_type:
-                load_data(key, value, file_type, project_root)
+                load_data(file_path, value, file_type,
+                          batch_size=options['batch_size'],
+                          workers=options['workers'])
+                bump_version(key)
             else:
                 print(f'Файл для {key} не найден. Пропуск.')
 
@@ -0,0 +1,149 @@
+"""Построение копий изображений рецептов в состоянии pending.
+
+Запускается из директории backend
+командой `python manage.py process_images`.
+По умолчанию работает постоянно, проверяя очередь каждые --interval
+секунд; с флагом --once завершается, когда очередь пуста.
+С флагом --all копии всех рецептов предварительно помечаются
+устаревшими.
+
+При IMAGE_PROCESSING=pool новые изображения обрабатывает пул
+веб-сервера, а команда (сервис images в docker-compose) берет только
+рецепты, ожидающие дольше --min-age секунд (по умолчанию
+IMAGE_PENDING_TIMEOUT), то есть потерянные при падении процесса пула
+или перезапуске веб-сервера.
+"""
+import time
+from concurrent.futures import as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+from recipes.cache import bump_version
+from recipes.images import (get_format, mark_failed, original_source,
+                            render_all, save_renditions)
+from recipes.models import Recipe
+from recipes.tasks import create_executor
+
+BATCH_SIZE = 20
+
+
+class Command(BaseCommand):
+    """Класс обработчика очереди изображений рецептов."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.IMAGE_WORKERS,
+            help='Количество процессов (0 - в текущем процессе).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Количество рецептов, выбираемых из очереди за раз.',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Пауза между проверками пустой очереди, в секундах.',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=float,
+            default=(settings.IMAGE_PENDING_TIMEOUT
+                     if settings.IMAGE_PROCESSING == 'pool' else 0),
+            help=('Обрабатывать только рецепты, ожидающие дольше '
+                  'стольких секунд.'),
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать очередь и завершиться.',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Перестроить копии всех рецептов.',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 0:
+            raise CommandError('--workers не может быть отрицательным.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
+        if options['min_age'] < 0:
+            raise CommandError('--min-age не может быть отрицательным.')
+        min_age = timedelta(seconds=options['min_age'])
+        if options['all']:
+            Recipe.objects.exclude(image='').update(
+                image_status=Recipe.ImageStatus.PENDING)
+            bump_version('recipes')
+            min_age = timedelta()
+        executor = (create_executor(options['workers'])
+                    if options['workers'] else None)
+        processed = failed = 0
+        try:
+            while True:
+                recipes = list(
+                    Recipe.objects
+                    .filter(image_status=Recipe.ImageStatus.PENDING,
+                            updated_at__lte=timezone.now() - min_age)
+                    .exclude(image='')
+                    .only('id', 'image', 'renditions', 'image_status')
+                    .order_by('updated_at')[:options['batch_size']]
+                )
+                if not recipes:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+                for _, ok in self.process(recipes, executor):
+                    if ok:
+                        processed += 1
+                    else:
+                        failed += 1
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        print(f'Обработано {processed} рецептов, с ошибками {failed}.')
+
+    @staticmethod
+    def process(recipes, executor):
+        """
+        Строит копии для пачки рецептов и для каждого возвращает пару
+        (рецепт, успех).
+        """
+        image_format = get_format()
+        quality = settings.IMAGE_RENDITION_QUALITY
+        futures = {}
+        for recipe in recipes:
+            try:
+                source = original_source(recipe)
+                if executor is None:
+                    save_renditions(
+                        recipe, render_all(source, image_format, quality),
+                        image_format)
+                    yield recipe, True
+                    continue
+            except Exception as error:
+                print(f'Рецепт {recipe.pk}: {error}')
+                mark_failed(recipe)
+                yield recipe, False
+                continue
+            future = executor.submit(
+                render_all, source, image_format, quality)
+            futures[future] = recipe
+        for future in as_completed(futures):
+            recipe = futures[future]
+            try:
+                save_renditions(recipe, future.result(), image_format)
+            except Exception as error:
+                print(f'Рецепт {recipe.pk}: {error}')
+                mark_failed(recipe)
+                yield recipe, False
+            else:
+                yield recipe, True
@@ -0,0 +1,19 @@
+"""Пересчет денормализованных счетчиков.
+
+Запускается из директории backend
+командой `python manage.py recalculate_counters`.
+"""
+from django.core.management import BaseCommand
+from django.db import transaction
+from recipes.counters import recalculate_counters
+
+
+class Command(BaseCommand):
+    """Класс пересчета счетчиков избранного, корзины, рецептов
+    и подписчиков."""
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = recalculate_counters()
+        for counter, count in fixed.items():
+            print(f'{counter}: исправлено {count} записей.')
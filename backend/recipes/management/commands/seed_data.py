@@ -0,0 +1,364 @@
+"""Генерация синтетических данных для профилирования и нагрузочных тестов.
+
+Запускается из директории backend после `python manage.py import_data`
+командой `python manage.py seed_data --users 100000 --recipes 1000000`.
+
+Создает пользователей, рецепты с ингредиентами и тегами, подписки,
+избранное и корзины. Популярность ингредиентов, авторов и рецептов
+распределена по закону Ципфа: немногие авторы пишут большую часть
+рецептов, и на них же больше подписываются. При одинаковом --seed
+создаются одинаковые данные (кроме солей паролей).
+
+Пользователи и рецепты вставляются пачками через bulk_create, а связи
+между ними - без создания объектов моделей (COPY в PostgreSQL,
+executemany в остальных базах); каждая пачка в своей транзакции.
+Сигналы при этом не отправляются, поэтому маски тегов и поисковые
+документы заполняются здесь же, счетчики в конце пересчитываются,
+как командой recalculate_counters, а версия рецептов для условных
+GET-запросов обновляется.
+
+Пароль всех пользователей - --password, его хеш вычисляется один раз.
+С флагом --unique-passwords пользователь userS_N получает пароль
+`<password>N`, хеши вычисляются параллельно в --workers процессах.
+"""
+import csv
+import io
+import os
+import random
+import time
+from bisect import bisect
+from collections import Counter
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.cache import bump_version
+from recipes.counters import recalculate_counters
+from recipes.fulltext import index_recipes
+from recipes.models import (Ingredient, IngredientInRecipe, Recipe,
+                            RecipesFavorite, ShoppingCart, Tag)
+from recipes.tagsets import update_tag_ids
+from recipes.tasks import create_executor
+from users.models import Follow, User
+
+BATCH_SIZE = 5000
+# Показатель распределения Ципфа для популярности.
+ZIPF_EXPONENT = 1.1
+
+FIRST_NAMES = (
+    'Александр', 'Анна', 'Дмитрий', 'Елена', 'Иван', 'Мария', 'Михаил',
+    'Наталья', 'Никита', 'Ольга', 'Павел', 'Светлана', 'Сергей',
+    'Татьяна', 'Юлия', 'Андрей', 'Ирина', 'Алексей', 'Екатерина',
+    'Владимир',
+)
+LAST_NAMES = (
+    'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров',
+    'Соколов', 'Михайлов', 'Новиков', 'Федоров', 'Морозов', 'Волков',
+    'Алексеев', 'Лебедев', 'Семенов', 'Егоров', 'Павлов', 'Козлов',
+    'Степанов', 'Николаев',
+)
+DISHES = (
+    'Салат', 'Суп', 'Запеканка', 'Пирог', 'Омлет', 'Каша', 'Рагу',
+    'Паста', 'Смузи', 'Соус', 'Жаркое', 'Десерт', 'Пицца', 'Плов',
+    'Котлеты', 'Оладьи',
+)
+STEPS = (
+    'Подготовьте {0} и {1}.',
+    'Нарежьте {0}, добавьте {1} и перемешайте.',
+    'Обжарьте {0} на среднем огне {2} минут.',
+    'Смешайте {0} с {1} и оставьте на {2} минут.',
+    'Запекайте {0} при 180 градусах {2} минут.',
+    'Подавайте, украсив {1}.',
+)
+# Количество ингредиента по единице измерения: (минимум, максимум, шаг).
+AMOUNTS = {
+    'г': (10, 500, 10),
+    'кг': (1, 3, 1),
+    'мл': (10, 500, 10),
+    'шт.': (1, 6, 1),
+    'ст. л.': (1, 4, 1),
+    'ч. л.': (1, 3, 1),
+    'стакан': (1, 3, 1),
+}
+DEFAULT_AMOUNT = (1, 5, 1)
+
+
+def zipf_weights(size, exponent=ZIPF_EXPONENT):
+    """Накопленные веса распределения Ципфа для size элементов."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, size + 1)))
+
+
+def weighted_sample(rng, population, cum_weights, k):
+    """
+    Выбирает k различных элементов с учетом накопленных весов.
+    Если редкие элементы долго не выпадают, выборка дополняется
+    равновероятно.
+    """
+    k = min(k, len(population))
+    total = cum_weights[-1]
+    chosen = {}
+    for _ in range(10 * k):
+        if len(chosen) == k:
+            break
+        index = bisect(cum_weights, rng.random() * total)
+        chosen.setdefault(index, population[index])
+    if len(chosen) < k:
+        rest = [index for index in range(len(population))
+                if index not in chosen]
+        for index in rng.sample(rest, k - len(chosen)):
+            chosen[index] = population[index]
+    return list(chosen.values())
+
+
+def random_count(rng, mean, limit):
+    """Количество со средним mean: экспоненциальное, не больше limit."""
+    if mean <= 0:
+        return 0
+    return min(int(rng.expovariate(1 / mean)), limit)
+
+
+def insert_rows(model, fields, rows):
+    """Вставляет строки значений полей fields, не создавая объектов."""
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(
+        connection.ops.quote_name(model._meta.get_field(name).column)
+        for name in fields)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor.copy_expert(
+                f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)',
+                buffer)
+        else:
+            placeholders = ', '.join(['%s'] * len(fields))
+            cursor.executemany(
+                f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+                rows)
+    return len(rows)
+
+
+def batched_range(total, size):
+    for start in range(0, total, size):
+        yield range(start, min(start + size, total))
+
+
+class Command(BaseCommand):
+    """Класс генерации пользователей, рецептов и связей между ними."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Количество пользователей.')
+        parser.add_argument('--recipes', type=int, default=10000,
+                            help='Количество рецептов.')
+        parser.add_argument('--follows', type=float, default=10,
+                            help='Среднее число подписок пользователя.')
+        parser.add_argument('--favorites', type=float, default=20,
+                            help='Среднее число избранных рецептов.')
+        parser.add_argument('--cart', type=float, default=3,
+                            help='Среднее число рецептов в корзине.')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Начальное значение генератора.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Количество записей в одной вставке.')
+        parser.add_argument('--password', default='password',
+                            help='Пароль пользователей.')
+        parser.add_argument('--unique-passwords', action='store_true',
+                            help='Свой пароль у каждого пользователя.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Процессы для хеширования паролей.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['recipes'] < 0:
+            raise CommandError(
+                'Нужен хотя бы один пользователь, --recipes '
+                'не может быть отрицательным.')
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError(
+                '--batch-size и --workers должны быть положительными.')
+        self.ingredients = list(
+            Ingredient.objects.order_by('name', 'measurement_unit'))
+        self.tags = list(Tag.objects.order_by('slug'))
+        if not self.ingredients or not self.tags:
+            raise CommandError(
+                'Сначала загрузите ингредиенты и теги командой '
+                '`python manage.py import_data`.')
+        self.prefix = f'user{options["seed"]}_'
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(
+                f'Пользователи {self.prefix}* уже созданы, '
+                'укажите другой --seed.')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+
+        user_ids = self.create_users(
+            options['users'], options['password'],
+            options['unique_passwords'], options['workers'])
+        print(f'Создано {len(user_ids)} пользователей.')
+        recipe_ids, authors = self.create_recipes(
+            options['recipes'], user_ids)
+        print(f'Создано {len(recipe_ids)} рецептов.')
+        follows = self.create_follows(user_ids, authors, options['follows'])
+        print(f'Создано {follows} подписок.')
+        for model, mean in ((RecipesFavorite, options['favorites']),
+                            (ShoppingCart, options['cart'])):
+            count = self.create_user_recipes(
+                model, user_ids, recipe_ids, mean)
+            print(f'{model._meta.verbose_name_plural}: '
+                  f'создано {count} записей.')
+        with transaction.atomic():
+            recalculate_counters()
+        bump_version('recipes')
+        print(f'Готово за {time.monotonic() - started:.1f} с.')
+
+    def create_users(self, count, password, unique_passwords, workers):
+        """Создает пользователей и возвращает их id."""
+        rng = self.rng
+        if unique_passwords:
+            executor = create_executor(workers)
+            try:
+                hashes = executor.map(
+                    make_password,
+                    (f'{password}{index}' for index in range(count)),
+                    chunksize=max(1, min(100, count // workers)),
+                )
+                hashes = list(hashes)
+            finally:
+                executor.shutdown()
+        else:
+            hashes = [make_password(password)] * count
+        user_ids = []
+        for batch in batched_range(count, self.batch_size):
+            users = [
+                User(
+                    username=f'{self.prefix}{index}',
+                    email=f'{self.prefix}{index}@example.com',
+                    first_name=rng.choice(FIRST_NAMES),
+                    last_name=rng.choice(LAST_NAMES),
+                    password=hashes[index],
+                )
+                for index in batch
+            ]
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+            user_ids.extend(user.pk for user in users)
+        return user_ids
+
+    def build_recipe(self, author_id, ingredients, tags):
+        """Рецепт с правдоподобными названием, описанием и временем."""
+        rng = self.rng
+        names = [ingredient.name for ingredient in ingredients]
+        cooking_time = max(1, min(600, int(rng.lognormvariate(3.3, 0.6))))
+        text = ' '.join(
+            step.format(rng.choice(names), rng.choice(names),
+                        rng.randint(5, 40))
+            for step in rng.sample(STEPS, rng.randint(2, 5))
+        )
+        return Recipe(
+            author_id=author_id,
+            name=f'{rng.choice(DISHES)}: {names[0]}'[:200],
+            text=text,
+            cooking_time=cooking_time,
+            tags_mask=sum(tag.mask for tag in tags),
+        )
+
+    def amount(self, ingredient):
+        low, high, step = AMOUNTS.get(
+            ingredient.measurement_unit, DEFAULT_AMOUNT)
+        return self.rng.randrange(low, high + 1, step)
+
+    def create_recipes(self, count, user_ids):
+        """
+        Создает рецепты с ингредиентами и тегами. Возвращает id
+        рецептов и счетчик рецептов по авторам.
+        """
+        rng = self.rng
+        authors = user_ids[:]
+        rng.shuffle(authors)
+        author_weights = zipf_weights(len(authors))
+        ingredients = self.ingredients[:]
+        rng.shuffle(ingredients)
+        ingredient_weights = zipf_weights(len(ingredients))
+        tag_weights = zipf_weights(len(self.tags))
+        recipe_ids = []
+        recipes_by_author = Counter()
+        for batch in batched_range(count, self.batch_size):
+            recipes, links = [], []
+            for _ in batch:
+                author_id = weighted_sample(
+                    rng, authors, author_weights, 1)[0]
+                recipe_ingredients = weighted_sample(
+                    rng, ingredients, ingredient_weights,
+                    round(rng.triangular(3, 15, 6)))
+                tags = weighted_sample(
+                    rng, self.tags, tag_weights, rng.randint(1, 3))
+                recipe = self.build_recipe(
+                    author_id, recipe_ingredients, tags)
+                recipes.append(recipe)
+                links.append((recipe, recipe_ingredients, tags))
+                recipes_by_author[author_id] += 1
+            with transaction.atomic():
+                Recipe.objects.bulk_create(recipes)
+                insert_rows(Recipe.tags.through, ('recipe', 'tag'), [
+                    (recipe.pk, tag.pk)
+                    for recipe, _, tags in links for tag in tags
+                ])
+                insert_rows(
+                    IngredientInRecipe, ('recipe', 'ingredient', 'amount'), [
+                        (recipe.pk, ingredient.pk, self.amount(ingredient))
+                        for recipe, recipe_ingredients, _ in links
+                        for ingredient in recipe_ingredients
+                    ])
+                index_recipes(recipes)
+                update_tag_ids(Recipe.objects.filter(
+                    pk__in=[recipe.pk for recipe in recipes]))
+            recipe_ids.extend(recipe.pk for recipe in recipes)
+        return recipe_ids, recipes_by_author
+
+    def create_follows(self, user_ids, recipes_by_author, mean):
+        """Подписки: на авторов с большим числом рецептов чаще."""
+        authors = [author for author, _ in recipes_by_author.most_common()]
+        if not authors:
+            return 0
+        weights = list(accumulate(
+            recipes_by_author[author] for author in authors))
+        created = 0
+        for batch in batched_range(len(user_ids), self.batch_size):
+            follows = []
+            for index in batch:
+                user_id = user_ids[index]
+                count = random_count(self.rng, mean, len(authors))
+                follows.extend(
+                    (user_id, author_id)
+                    for author_id in weighted_sample(
+                        self.rng, authors, weights, count)
+                    if author_id != user_id
+                )
+            with transaction.atomic():
+                created += insert_rows(Follow, ('user', 'author'), follows)
+        return created
+
+    def create_user_recipes(self, model, user_ids, recipe_ids, mean):
+        """Избранное или корзина: популярные рецепты выбираются чаще."""
+        if not recipe_ids:
+            return 0
+        recipes = recipe_ids[:]
+        self.rng.shuffle(recipes)
+        weights = zipf_weights(len(recipes))
+        created = 0
+        for batch in batched_range(len(user_ids), self.batch_size):
+            rows = []
+            for index in batch:
+                count = random_count(self.rng, mean, len(recipes))
+                rows.extend(
+                    (user_ids[index], recipe_id)
+                    for recipe_id in weighted_sample(
+                        self.rng, recipes, weights, count)
+                )
+            with transaction.atomic():
+                created += insert_rows(model, ('user', 'recipe'), rows)
+        return created
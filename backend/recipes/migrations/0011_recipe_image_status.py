@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:29
+
+from django.db import migrations, models
+
+
+def mark_pending(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.exclude(image='').filter(renditions={}).update(
+        image_status='pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_status',
+            field=models.CharField(choices=[('pending', 'Обрабатывается'), ('ready', 'Готово'), ('failed', 'Ошибка обработки')], db_index=True, default='ready', editable=False, max_length=16, verbose_name='Состояние обработки изображения'),
+        ),
+        migrations.RunPython(mark_pending, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+MAX_TAGS = 63
+
+
+def fill_masks(apps, schema_editor):
+    Tag = apps.get_model('recipes', 'Tag')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    tags = list(Tag.objects.order_by('id'))
+    if len(tags) > MAX_TAGS:
+        raise ValueError(f'Поддерживается не больше {MAX_TAGS} тегов.')
+    for bit, tag in enumerate(tags):
+        tag.mask = 1 << bit
+    Tag.objects.bulk_update(tags, ['mask'])
+    Recipe.objects.update(tags_mask=Coalesce(Subquery(
+        Recipe.tags.through.objects.filter(recipe=OuterRef('pk'))
+        .order_by().values('recipe')
+        .annotate(total=Sum('tag__mask')).values('total')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='mask',
+            field=models.BigIntegerField(
+                editable=False, null=True, verbose_name='Битовая маска'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(
+                default=0, editable=False, verbose_name='Маска тегов'),
+        ),
+        migrations.RunPython(fill_masks, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='mask',
+            field=models.BigIntegerField(
+                editable=False, unique=True, verbose_name='Битовая маска'),
+        ),
+    ]
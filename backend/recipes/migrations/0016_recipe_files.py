@@ -0,0 +1,56 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def fill_files(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeFile = apps.get_model('recipes', 'RecipeFile')
+    files = []
+    for pk, image, renditions in Recipe.objects.values_list(
+            'pk', 'image', 'renditions').iterator():
+        names = set((renditions or {}).values())
+        if image:
+            names.add(image)
+        files.extend(RecipeFile(recipe_id=pk, name=name) for name in names)
+        if len(files) >= BATCH_SIZE:
+            RecipeFile.objects.bulk_create(files)
+            files = []
+    RecipeFile.objects.bulk_create(files)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_recipe_tags_mask_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeFile',
+            fields=[
+                ('id', models.BigAutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID')),
+                ('name', models.CharField(
+                    db_index=True, max_length=255,
+                    verbose_name='Имя файла')),
+                ('recipe', models.ForeignKey(
+                    db_index=False,
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='files', to='recipes.recipe',
+                    verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Файл рецепта',
+                'verbose_name_plural': 'Файлы рецептов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='recipefile',
+            constraint=models.UniqueConstraint(
+                fields=('recipe', 'name'), name='unique recipe file'),
+        ),
+        migrations.RunPython(fill_files, migrations.RunPython.noop),
+    ]
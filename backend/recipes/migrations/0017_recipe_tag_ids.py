@@ -0,0 +1,40 @@
+from django.db import migrations
+
+
+def create_tag_ids(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'ALTER TABLE recipes_recipe '
+        "ADD COLUMN tag_ids integer[] NOT NULL DEFAULT '{}'"
+    )
+    schema_editor.execute(
+        'UPDATE recipes_recipe SET tag_ids = ARRAY('
+        'SELECT tag_id FROM recipes_recipe_tags '
+        'WHERE recipe_id = recipes_recipe.id ORDER BY tag_id)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX recipes_recipe_tag_ids '
+        'ON recipes_recipe USING gin (tag_ids)'
+    )
+
+
+def drop_tag_ids(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('ALTER TABLE recipes_recipe DROP COLUMN tag_ids')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_recipe_files'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='recipe',
+            name='recipe_tags_mask_idx',
+        ),
+        migrations.RunPython(create_tag_ids, drop_tag_ids),
+    ]
@@ -1,8 +1,11 @@
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from django.db.models.functions import Coalesce
 from foodgram.settings import LIMIT_VALUE
 from users.models import User
 
+from .tagsets import update_tag_ids
+
 
 class Ingredient(models.Model):
     """Ингредиенты."""
@@ -30,7 +33,14 @@ class Ingredient(models.Model):
 
 
 class Tag(models.Model):
-    """Тэги."""
+    """Тэги.
+
+    Каждому тегу принадлежит один бит маски, а маска тегов рецепта
+    (Recipe.tags_mask) - сумма масок его тегов, по которой проверяется
+    наличие всех выбранных тегов у рецепта (см. recipes.tagsets).
+    """
+
+    MAX_TAGS = 63
 
     name = models.CharField(
         'Название тега',
@@ -49,6 +59,11 @@ class Tag(models.Model):
             message='Введите правильный slug.',
             code='invalid_slug')],
     )
+    mask = models.BigIntegerField(
+        'Битовая маска',
+        unique=True,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Тег'
@@ -57,10 +72,87 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if not self.mask:
+            self.assign_masks([self])
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def assign_masks(cls, tags):
+        """Назначает тегам без маски свободные биты."""
+        used = set(cls.objects.values_list('mask', flat=True))
+        used.update(tag.mask for tag in tags if tag.mask)
+        free = (1 << bit for bit in range(cls.MAX_TAGS)
+                if 1 << bit not in used)
+        for tag in tags:
+            if not tag.mask:
+                tag.mask = next(free, None)
+                if tag.mask is None:
+                    raise ValueError(
+                        f'Нельзя создать больше {cls.MAX_TAGS} тегов.')
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Набор запросов для рецептов."""
+
+    def with_related(self):
+        """
+        Загружает автора, теги и количества ингредиентов заранее,
+        чтобы сериализация списка не выполняла запросов на каждый рецепт.
+        """
+        return self.select_related('author').prefetch_related(
+            'tags',
+            models.Prefetch(
+                'amounts',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'),
+            ),
+        )
+
+    def with_user_flags(self, user):
+        """
+        Аннотирует рецепты признаками is_favorited и is_in_shopping_cart
+        для пользователя подзапросами Exists().
+        """
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=models.Value(False),
+                is_in_shopping_cart=models.Value(False),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(RecipesFavorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+        )
+
+    def update_tags_mask(self):
+        """
+        Пересчитывает маски тегов рецептов по их связям с тегами,
+        а на PostgreSQL - и массивы тегов (см. recipes.tagsets).
+        """
+        update_tag_ids(self)
+        return self.update(tags_mask=Coalesce(
+            models.Subquery(
+                Recipe.tags.through.objects
+                .filter(recipe=models.OuterRef('pk'))
+                .order_by()
+                .values('recipe')
+                .annotate(total=models.Sum('tag__mask'))
+                .values('total')
+            ),
+            0,
+        ))
+
 
 class Recipe(models.Model):
     """Рецепты."""
 
+    class ImageStatus(models.TextChoices):
+        PENDING = 'pending', 'Обрабатывается'
+        READY = 'ready', 'Готово'
+        FAILED = 'failed', 'Ошибка обработки'
+
     tags = models.ManyToManyField(
         Tag,
         verbose_name='Список тегов',
@@ -71,6 +163,7 @@ class Recipe(models.Model):
         verbose_name='Автор',
         on_delete=models.CASCADE,
         related_name='recipes',
+        db_index=False,
     )
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -90,6 +183,25 @@ class Recipe(models.Model):
         max_length=200,
         help_text='Выберите изображение для рецепта'
     )
+    renditions = models.JSONField(
+        verbose_name='Производные изображения',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    tags_mask = models.BigIntegerField(
+        verbose_name='Маска тегов',
+        default=0,
+        editable=False,
+    )
+    image_status = models.CharField(
+        verbose_name='Состояние обработки изображения',
+        max_length=16,
+        choices=ImageStatus.choices,
+        default=ImageStatus.READY,
+        db_index=True,
+        editable=False,
+    )
     text = models.TextField(
         verbose_name='Описание рецепта'
     )
@@ -107,11 +219,70 @@ class Recipe(models.Model):
         auto_now_add=True,
         db_index=True,
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+        db_index=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в избранное',
+        default=0,
+        editable=False,
+    )
+    carts_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в корзину',
+        default=0,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Имя изображения при загрузке, чтобы после замены освободить
+        # старый файл (см. recipes.signals).
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class RecipeFile(models.Model):
+    """Файлы хранилища, на которые ссылается рецепт (см. recipes.storage)."""
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='files',
+        verbose_name='Рецепт',
+        db_index=False,
+    )
+    name = models.CharField(
+        verbose_name='Имя файла',
+        max_length=255,
+        db_index=True,
+    )
+
+    class Meta:
+        verbose_name = 'Файл рецепта'
+        verbose_name_plural = 'Файлы рецептов'
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'name'],
+                                    name='unique recipe file')
+        ]
 
     def __str__(self):
         return self.name
@@ -124,7 +295,8 @@ class IngredientInRecipe(models.Model):
         Recipe,
         on_delete=models.CASCADE,
         related_name='amounts',
-        verbose_name='Рецепт'
+        verbose_name='Рецепт',
+        db_index=False,
     )
     ingredient = models.ForeignKey(
         Ingredient,
@@ -151,6 +323,12 @@ class IngredientInRecipe(models.Model):
                 name='unique ingredient amount',
             ),
         )
+        indexes = (
+            # Покрывающий индекс для списка покупок: количества
+            # ингредиентов рецепта читаются без обращения к таблице.
+            models.Index(fields=('recipe', 'ingredient', 'amount'),
+                         name='amount_recipe_ingredient_idx'),
+        )
 
 
 class RecipesFavorite(models.Model):
@@ -167,6 +345,7 @@ class RecipesFavorite(models.Model):
         on_delete=models.CASCADE,
         related_name='favorites',
         verbose_name='Рецепт',
+        db_index=False,
     )
 
     class Meta:
@@ -176,6 +355,10 @@ class RecipesFavorite(models.Model):
             models.UniqueConstraint(fields=['user', 'recipe'],
                                     name='unique favorite')
         ]
+        indexes = [
+            models.Index(fields=['recipe', 'user'],
+                         name='favorite_recipe_user_idx'),
+        ]
 
 
 class ShoppingCart(models.Model):
@@ -192,6 +375,7 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         related_name='carts',
         verbose_name='Рецепт',
+        db_index=False,
     )
 
     class Meta:
@@ -201,3 +385,7 @@ class ShoppingCart(models.Model):
             models.UniqueConstraint(fields=['user', 'recipe'],
                                     name='unique shopping cart')
         ]
+        indexes = [
+            models.Index(fields=['recipe', 'user'],
+                         name='cart_recipe_user_idx'),
+        ]
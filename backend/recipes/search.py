@@ -0,0 +1,134 @@
+"""Поиск ингредиентов для автодополнения.
+
+Индекс держит в памяти процесса отсортированный список названий
+ингредиентов, приведенных к нижнему регистру (с заменой «ё» на «е»),
+и отвечает на запросы без обращения к базе данных. Совпадения
+по началу названия ищутся бинарным поиском, совпадения в середине -
+по спискам позиций n-грамм (подстрок длиной до NGRAM символов).
+
+Индекс строится при первом запросе и перестраивается, когда меняется
+общая для всех процессов версия справочника ingredients (ее
+увеличивают сигналы и import_data). Версия запоминается до чтения
+базы, поэтому изменение во время построения не теряется. Если кеш
+не общий для процессов, индекс дополнительно перестраивается
+не реже, чем раз в INGREDIENT_INDEX_TTL секунд.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+from .cache import get_version
+
+NGRAM = 3
+
+
+def fold(value: str) -> str:
+    """Приводит строку к виду для сравнения без учета регистра."""
+    return value.casefold().replace('ё', 'е')
+
+
+def ngrams(value: str, size: int) -> set[str]:
+    """Все подстроки value длиной size."""
+    return {value[i:i + size] for i in range(len(value) - size + 1)}
+
+
+class IngredientIndex:
+    """Отсортированный префиксный индекс названий ингредиентов."""
+
+    namespace = 'ingredients'
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Ключи, ингредиенты и позиции n-грамм.
+        self._data: tuple[list[str], list[dict], dict] | None = None
+        self._version: int | None = None
+        self._built_at: float | None = None
+
+    def invalidate(self) -> None:
+        """Помечает индекс устаревшим в текущем процессе."""
+        with self._lock:
+            self._version = None
+
+    def build(self) -> None:
+        """Строит индекс по всем ингредиентам из базы данных."""
+        from recipes.models import Ingredient
+
+        version = get_version(self.namespace)
+        rows = sorted(
+            (
+                (fold(name), pk),
+                {'id': pk, 'name': name, 'measurement_unit': unit},
+            )
+            for pk, name, unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit')
+        )
+        keys = [key for (key, _), _ in rows]
+        # Позиции добавляются по возрастанию, поэтому списки
+        # отсортированы в порядке названий.
+        positions = defaultdict(list)
+        for position, key in enumerate(keys):
+            for size in range(1, NGRAM + 1):
+                for gram in ngrams(key, size):
+                    positions[gram].append(position)
+        self._data = (keys, [item for _, item in rows], dict(positions))
+        self._version = version
+        self._built_at = time.monotonic()
+
+    def _is_stale(self, version: int) -> bool:
+        return (
+            self._version != version
+            or time.monotonic() - self._built_at > self.ttl
+        )
+
+    def _get_data(self):
+        version = get_version(self.namespace)
+        if self._is_stale(version):
+            with self._lock:
+                if self._is_stale(version):
+                    self.build()
+        return self._data
+
+    @staticmethod
+    def _substring_positions(keys, positions, query):
+        """Позиции названий, содержащих query, в порядке названий."""
+        if len(query) <= NGRAM:
+            return positions.get(query, ())
+        # Кандидаты берутся из самого короткого списка n-граммы запроса
+        # и проверяются целиком.
+        candidates = min(
+            (positions.get(gram, ()) for gram in ngrams(query, NGRAM)),
+            key=len,
+        )
+        return (
+            position for position in candidates
+            if query in keys[position]
+        )
+
+    def search(self, query: str, limit: int) -> list[dict]:
+        """
+        Возвращает не более limit ингредиентов: сначала те, чье название
+        начинается с query, затем содержащие query в середине.
+        """
+        keys, items, positions = self._get_data()
+        query = fold(query.strip())
+        position = bisect_left(keys, query)
+        result = []
+        while (position < len(keys) and len(result) < limit
+               and keys[position].startswith(query)):
+            result.append(items[position])
+            position += 1
+        if query and len(result) < limit:
+            for position in self._substring_positions(
+                    keys, positions, query):
+                if not keys[position].startswith(query):
+                    result.append(items[position])
+                    if len(result) == limit:
+                        break
+        return result
+
+
+ingredient_index = IngredientIndex(ttl=settings.INGREDIENT_INDEX_TTL)
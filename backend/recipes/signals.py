@@ -0,0 +1,115 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from users.models import User
+
+from .cache import bump_version
+from .fulltext import index_recipe, unindex_recipe
+from .images import delete_renditions
+from .models import Ingredient, Recipe, Tag
+from .storage import release_file, update_references
+from .tagsets import remove_tag_id
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    """
+    Сбрасывает закешированные ответы и индекс поиска ингредиентов
+    во всех процессах.
+    """
+    bump_version('ingredients')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags_cache(**kwargs):
+    """Сбрасывает закешированные ответы справочника тегов."""
+    bump_version('tags')
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipes_cache(action='post_save', **kwargs):
+    """Меняет версию рецептов для условных запросов."""
+    if action.startswith('post_'):
+        bump_version('recipes')
+
+
+@receiver(post_save, sender=User)
+def invalidate_users_cache(created, update_fields=None, **kwargs):
+    """
+    Меняет версию профилей авторов, выводимых в рецептах. Вход
+    пользователя (обновление last_login) версию не меняет.
+    """
+    if not created and set(update_fields or ()) != {'last_login'}:
+        bump_version('users')
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(instance, created, **kwargs):
+    """
+    Обновляет ссылки рецепта на файлы и после замены изображения
+    освобождает старый файл.
+    """
+    old = getattr(instance, '_loaded_image', None)
+    if created or old != instance.image.name:
+        update_references(instance, created)
+    if old and old != instance.image.name:
+        transaction.on_commit(
+            partial(release_file, old, instance.image.storage))
+    instance._loaded_image = instance.image.name
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_images(instance, **kwargs):
+    """После удаления рецепта освобождает изображение и его копии."""
+    storage = instance.image.storage
+    transaction.on_commit(partial(release_file, instance.image.name, storage))
+    transaction.on_commit(
+        partial(delete_renditions, instance.renditions, storage))
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_document(instance, update_fields=None, **kwargs):
+    """Обновляет поисковый документ при изменении названия или описания."""
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        index_recipe(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_search_document(instance, **kwargs):
+    """Удаляет поисковый документ удаленного рецепта."""
+    unindex_recipe(instance.pk)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_tags_mask(instance, action, reverse, pk_set, **kwargs):
+    """Пересчитывает маску тегов рецептов при изменении их тегов."""
+    if reverse and action == 'pre_clear':
+        instance._cleared_recipe_ids = list(
+            instance.recipes.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif pk_set is not None:
+        recipe_ids = pk_set
+    else:
+        recipe_ids = instance.__dict__.pop('_cleared_recipe_ids', [])
+    Recipe.objects.filter(pk__in=recipe_ids).update_tags_mask()
+
+
+@receiver(post_delete, sender=Tag)
+def remove_tag_from_masks(instance, **kwargs):
+    """Снимает бит удаленного тега с масок и массивов тегов рецептов."""
+    remove_tag_id(instance.pk)
+    Recipe.objects.annotate(
+        tag_bit=F('tags_mask').bitand(instance.mask)
+    ).filter(tag_bit__gt=0).update(
+        tags_mask=F('tags_mask').bitand(~instance.mask))
@@ -0,0 +1,114 @@
+"""Хранилище медиафайлов с адресацией по содержимому.
+
+Файл сохраняется под именем, равным SHA-256 его содержимого, в
+подкаталогах по первым символам хеша (`ab/cd/abcd...ef.png`), поэтому
+одинаковые изображения хранятся один раз, а адрес файла никогда не
+меняет содержимое и может кешироваться навсегда.
+
+Один файл может использоваться несколькими рецептами, поэтому
+удаляется он только тогда, когда на него не ссылается ни один
+рецепт (release_file). Ссылки рецептов на изображение и его копии
+хранятся в таблице RecipeFile с индексом по имени файла, чтобы
+проверка ссылок не перебирала рецепты. Файлы, оставшиеся без ссылок,
+удаляет команда `python manage.py cleanup_media`.
+
+Сохранение уже существующего файла обновляет время его изменения,
+а release_file не удаляет файлы моложе MEDIA_ORPHAN_MIN_AGE секунд:
+на такой файл может ссылаться рецепт, транзакция которого еще
+не зафиксирована.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+HASHED_NAME_RE = re.compile(
+    r'^(?:.+/)?([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.[a-z0-9]+$')
+
+
+def content_hash(content):
+    """Вычисляет SHA-256 содержимого файла, читая его фрагментами."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+class HashedFileSystemStorage(FileSystemStorage):
+    """Файловое хранилище, именующее файлы хешем содержимого."""
+
+    def hashed_name(self, name, digest):
+        directory, file_name = posixpath.split(name)
+        extension = posixpath.splitext(file_name)[1].lower()
+        return posixpath.join(
+            directory, digest[:2], digest[2:4], f'{digest}{extension}')
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content_hash(content))
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return super()._save(name, content)
+        return name
+
+
+def is_hashed_name(name):
+    """Проверяет, что имя файла получено из хеша его содержимого."""
+    return HASHED_NAME_RE.match(name) is not None
+
+
+def recipe_files(recipe):
+    """Возвращает имена файлов изображения рецепта и его копий."""
+    names = set((recipe.renditions or {}).values())
+    if recipe.image:
+        names.add(recipe.image.name)
+    return names
+
+
+def update_references(recipe, created=False):
+    """Записывает в RecipeFile текущие ссылки рецепта на файлы."""
+    from .models import RecipeFile
+
+    names = recipe_files(recipe)
+    if not created:
+        RecipeFile.objects.filter(recipe=recipe).exclude(
+            name__in=names).delete()
+    RecipeFile.objects.bulk_create(
+        [RecipeFile(recipe=recipe, name=name) for name in names],
+        ignore_conflicts=True,
+    )
+
+
+def referenced_files():
+    """Возвращает множество имен файлов, на которые ссылаются рецепты."""
+    from .models import RecipeFile
+
+    return set(
+        RecipeFile.objects.values_list('name', flat=True).iterator())
+
+
+def is_referenced(name):
+    """Проверяет, ссылается ли на файл хотя бы один рецепт."""
+    from .models import RecipeFile
+
+    return RecipeFile.objects.filter(name=name).exists()
+
+
+def release_file(name, storage):
+    """
+    Удаляет файл, если на него больше не ссылается ни один рецепт
+    и он не сохранялся последние MEDIA_ORPHAN_MIN_AGE секунд.
+    """
+    if not name or is_referenced(name):
+        return
+    try:
+        modified = storage.get_modified_time(name).timestamp()
+    except FileNotFoundError:
+        return
+    if time.time() - modified >= settings.MEDIA_ORPHAN_MIN_AGE:
+        storage.delete(name)
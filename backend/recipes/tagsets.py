@@ -0,0 +1,71 @@
+"""Отбор рецептов по набору тегов (tags_mode=any|all).
+
+На PostgreSQL набор тегов рецепта хранится в столбце
+recipes_recipe.tag_ids - отсортированном массиве integer[] с
+GIN-индексом. Рецепты с любым из тегов отбираются оператором &&,
+со всеми тегами - оператором @>, оба используют индекс. Массив
+пересчитывается вместе с маской тегов (RecipeQuerySet.update_tags_mask).
+
+В SQLite нет индексов по элементам массива, поэтому индексом служит
+таблица связей рецептов с тегами: рецепты отбираются подзапросом
+IN по индексу tag_id. В режиме all подзапрос отбирает рецепты
+с первым тегом, а остальные проверяются по маске тегов уже
+найденных рецептов. Подзапрос IN не размножает строки, поэтому
+DISTINCT не нужен.
+
+Столбец и индекс создает миграция 0017_recipe_tag_ids.
+"""
+from django.db import connection
+from django.db.models import BooleanField, F
+from django.db.models.expressions import RawSQL
+
+
+def filter_by_tags(queryset, tags, match_all=False):
+    """
+    Отбирает рецепты с любым (match_all=False) или со всеми
+    выбранными тегами.
+    """
+    table = queryset.model._meta.db_table
+    tag_ids = sorted({tag.pk for tag in tags})
+    if connection.vendor == 'postgresql':
+        operator = '@>' if match_all else '&&'
+        return queryset.filter(RawSQL(
+            f'{table}.tag_ids {operator} %s::integer[]', [tag_ids],
+            output_field=BooleanField(),
+        ))
+    through = queryset.model.tags.through.objects
+    if not match_all:
+        return queryset.filter(
+            pk__in=through.filter(tag__in=tag_ids).values('recipe'))
+    mask = sum({tag.mask for tag in tags})
+    return queryset.filter(
+        pk__in=through.filter(tag=tag_ids[0]).values('recipe'),
+    ).annotate(
+        matched_tags=F('tags_mask').bitand(mask),
+    ).filter(matched_tags=mask)
+
+
+def update_tag_ids(queryset):
+    """Пересчитывает массивы тегов рецептов queryset (PostgreSQL)."""
+    if connection.vendor != 'postgresql':
+        return
+    table = queryset.model._meta.db_table
+    through = queryset.model.tags.through._meta.db_table
+    sql, params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET tag_ids = ARRAY('
+            f'SELECT tag_id FROM {through} '
+            f'WHERE recipe_id = {table}.id ORDER BY tag_id'
+            f') WHERE id IN ({sql})', params)
+
+
+def remove_tag_id(tag_id):
+    """Удаляет тег из массивов тегов рецептов (PostgreSQL)."""
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'UPDATE recipes_recipe '
+            'SET tag_ids = array_remove(tag_ids, %s) '
+            'WHERE tag_ids @> ARRAY[%s]::integer[]', [tag_id, tag_id])
@@ -0,0 +1,126 @@
+"""Фоновое построение копий изображений рецептов.
+
+Очередью служит сама таблица рецептов: рецепт с новым изображением
+сохраняется в состоянии pending, а копии строятся после фиксации
+транзакции в зависимости от IMAGE_PROCESSING:
+
+- pool - в пуле процессов (IMAGE_WORKERS штук), принадлежащем
+  процессу веб-сервера; запрос не ждет обработки изображения;
+- worker - отдельной командой `python manage.py process_images`;
+- sync - в процессе запроса (для отладки и тестов).
+
+Рецепты, оставшиеся в состоянии pending после падения процесса пула
+или перезапуска веб-сервера, дообрабатывает команда process_images:
+в режиме pool она берет только рецепты, ожидающие дольше
+IMAGE_PENDING_TIMEOUT секунд (в docker-compose она запущена
+отдельным сервисом images).
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .images import (generate_renditions, get_format, mark_failed,
+                     original_source, render_all, save_renditions)
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def create_executor(workers):
+    """
+    Создает пул процессов. Процессы запускаются через forkserver,
+    чтобы не копировать потоки и соединения с базой веб-сервера.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('forkserver'),
+    )
+
+
+def get_executor():
+    """Возвращает пул процессов текущего процесса, создавая его."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = create_executor(settings.IMAGE_WORKERS)
+        return _executor
+
+
+def reset_executor():
+    """Отбрасывает сломанный пул, следующий вызов создаст новый."""
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def schedule_renditions(recipe):
+    """
+    Ставит построение копий изображения рецепта в очередь после
+    фиксации текущей транзакции. Рецепт должен быть сохранен
+    в состоянии pending.
+    """
+    if settings.IMAGE_PROCESSING == 'sync':
+        transaction.on_commit(partial(process_recipe, recipe))
+    elif settings.IMAGE_PROCESSING == 'pool':
+        transaction.on_commit(partial(submit_recipe, recipe))
+
+
+def process_recipe(recipe):
+    """Строит копии изображения рецепта в текущем процессе."""
+    try:
+        generate_renditions(recipe)
+    except Exception:
+        logger.exception('Не удалось обработать изображение рецепта %s',
+                         recipe.pk)
+        mark_failed(recipe)
+
+
+def submit_recipe(recipe):
+    """
+    Передает изображение рецепта в пул процессов. Файл из локального
+    хранилища читает процесс пула, а не поток запроса.
+    """
+    image_format = get_format()
+    try:
+        source = original_source(recipe)
+    except OSError:
+        logger.exception('Не удалось прочитать изображение рецепта %s',
+                         recipe.pk)
+        mark_failed(recipe)
+        return
+    args = (render_all, source, image_format,
+            settings.IMAGE_RENDITION_QUALITY)
+    try:
+        future = get_executor().submit(*args)
+    except BrokenProcessPool:
+        reset_executor()
+        future = get_executor().submit(*args)
+    future.add_done_callback(partial(finish_recipe, recipe, image_format))
+
+
+def finish_recipe(recipe, image_format, future):
+    """
+    Сохраняет результат обработки. Вызывается в служебном потоке пула,
+    поэтому по завершении закрывает соединения этого потока с базой.
+    Если пул остановлен, рецепт остается в состоянии pending
+    до запуска process_images.
+    """
+    try:
+        save_renditions(recipe, future.result(), image_format)
+    except BrokenProcessPool:
+        logger.exception('Пул обработки изображений остановлен')
+        reset_executor()
+    except Exception:
+        logger.exception('Не удалось обработать изображение рецепта %s',
+                         recipe.pk)
+        mark_failed(recipe)
+    finally:
+        connections.close_all()
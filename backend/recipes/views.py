@@ -1,87 +1,143 @@
-import csv
+import mimetypes
+import os
+from urllib.parse import quote
 
 from api.v1.filters import IngredientSearchFilter, RecipeFilter
-from api.v1.pagination import CustomPagination
+from api.v1.pagination import RecipePagination
+from api.v1.parsers import MultiPartJSONParser
 from api.v1.permissions import IsAuthorOrReadOnly
+from api.v1.renderers import (ShoppingListCSVRenderer,
+                              ShoppingListJSONRenderer,
+                              ShoppingListTextRenderer)
 from api.v1.serializers import (FavoriteSerializer, IngredientSerializer,
-                                RecipeListSerializer, RecipeSerializer,
-                                ShoppingCartSerializer, TagSerializer)
-from django.db import IntegrityError
-from django.http import HttpResponse
+                                RecipeDetailSerializer, RecipeListSerializer,
+                                RecipeSerializer, ShoppingCartSerializer,
+                                TagSerializer)
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.http import (FileResponse, Http404, HttpResponse,
+                         StreamingHttpResponse)
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_safe
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from users.models import User
 
+from .cache import (ConditionalGetMixin, VersionedCacheMixin, bump_version,
+                    user_namespace)
+from .counters import change_counter
 from .models import (Ingredient, IngredientInRecipe, Recipe, RecipesFavorite,
                      ShoppingCart, Tag)
+from .search import ingredient_index
+from .storage import is_hashed_name, is_referenced
 
 
-class TagsViewSet(ReadOnlyModelViewSet):
+class TagsViewSet(VersionedCacheMixin, ReadOnlyModelViewSet):
     """
     Класс отображения для работы с тегами.
     Добавить тег может администратор.
     """
+    cache_namespace = 'tags'
     queryset = Tag.objects.all()
     permission_classes = (AllowAny,)
     serializer_class = TagSerializer
 
 
-class IngredientsViewSet(ReadOnlyModelViewSet):
+class IngredientsViewSet(VersionedCacheMixin, ReadOnlyModelViewSet):
     """
     Класс отображения для работы с ингредиентами.
     Добавить ингредиент может администратор.
     """
+    cache_namespace = 'ingredients'
     queryset = Ingredient.objects.all()
     permission_classes = (AllowAny,)
     serializer_class = IngredientSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = IngredientSearchFilter
 
+    def list(self, request, *args, **kwargs):
+        """
+        Поиск по имени для автодополнения обслуживается индексом
+        в памяти процесса без обращения к базе данных.
+        """
+        name = request.query_params.get('name')
+        if name and settings.INGREDIENT_SEARCH_BACKEND == 'index':
+            return Response(ingredient_index.search(
+                name, settings.INGREDIENT_SEARCH_LIMIT))
+        return super().list(request, *args, **kwargs)
 
-class RecipeViewSet(ModelViewSet):
+
+class RecipeViewSet(ConditionalGetMixin, ModelViewSet):
     """
     Класс отображения для работы с рецептами.
     Для анонимов разрешен только просмотр рецептов.
     """
+    conditional_namespaces = ('recipes', 'users', 'tags', 'ingredients')
     queryset = Recipe.objects.all()
     permission_classes = [IsAuthorOrReadOnly]
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
-    pagination_class = CustomPagination
+    pagination_class = RecipePagination
+    parser_classes = [JSONParser, MultiPartJSONParser]
+
+    def get_queryset(self):
+        """
+        Рецепты с предзагруженными связями и признаками избранного
+        и корзины для пользователя.
+        """
+        return Recipe.objects.with_related().with_user_flags(
+            self.request.user)
 
     def get_serializer_class(self):
         """Получение класса сериализатора в зависимости от действия."""
-        if self.action in ('list', 'retrieve'):
+        if self.action == 'list':
             return RecipeListSerializer
+        if self.action == 'retrieve':
+            return RecipeDetailSerializer
         return RecipeSerializer
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            change_counter(User, instance.author_id, 'recipes_count', -1)
+
     @staticmethod
-    def post_method_for_actions(request, pk, serializers):
+    def post_method_for_actions(request, pk, serializers, counter):
         """Общий метод для обработки POST-запросов."""
         data = {'user': request.user.id, 'recipe': pk}
         serializer = serializers(data=data, context={'request': request})
         if serializer.is_valid():
             try:
-                serializer.save()
+                with transaction.atomic():
+                    serializer.save()
+                    change_counter(Recipe, pk, counter, 1)
             except IntegrityError:
                 return Response(status=status.HTTP_400_BAD_REQUEST)
+            bump_version(user_namespace(request.user.pk))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @staticmethod
-    def delete_method_for_actions(request, pk, model):
+    def delete_method_for_actions(request, pk, model, counter):
         """Общий метод для обработки DELETE-запросов."""
         user = request.user
         recipe = get_object_or_404(Recipe, id=pk)
-        try:
-            model_obj = model.objects.get(user=user, recipe=recipe)
-        except model.DoesNotExist:
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-        model_obj.delete()
+        with transaction.atomic():
+            deleted, _ = model.objects.filter(
+                user=user, recipe=recipe).delete()
+            if not deleted:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            change_counter(Recipe, recipe.pk, counter, -1)
+        bump_version(user_namespace(user.pk))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['POST'],
@@ -89,58 +145,93 @@ class RecipeViewSet(ModelViewSet):
     def favorite(self, request, pk):
         """Добавление рецепта в избранное."""
         return self.post_method_for_actions(
-            request=request, pk=pk, serializers=FavoriteSerializer)
+            request=request, pk=pk, serializers=FavoriteSerializer,
+            counter='favorites_count')
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk):
         """Удаление рецепта из избранного."""
         return self.delete_method_for_actions(
-            request=request, pk=pk, model=RecipesFavorite)
+            request=request, pk=pk, model=RecipesFavorite,
+            counter='favorites_count')
 
     @action(detail=True, methods=['POST'],
             permission_classes=[IsAuthenticated])
     def shopping_cart(self, request, pk):
         """Добавление рецепта в корзину покупок."""
         return self.post_method_for_actions(
-            request=request, pk=pk, serializers=ShoppingCartSerializer)
+            request=request, pk=pk, serializers=ShoppingCartSerializer,
+            counter='carts_count')
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk):
         """Удаление рецепта из корзины покупок."""
         return self.delete_method_for_actions(
-            request=request, pk=pk, model=ShoppingCart)
+            request=request, pk=pk, model=ShoppingCart,
+            counter='carts_count')
 
     @action(detail=False, methods=['GET'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=[ShoppingListCSVRenderer,
+                              ShoppingListJSONRenderer,
+                              ShoppingListTextRenderer])
     def download_shopping_cart(self, request):
-        """Загрузка списка покупок в виде CSV файла."""
+        """
+        Потоковая загрузка списка покупок.
+        Формат выбирается параметром `?format=csv|json|txt`
+        или заголовком Accept, по умолчанию CSV.
+        """
         user = self.request.user
-        shopping_cart_items = ShoppingCart.objects.filter(user=user)
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = ('attachment; '
-                                           'filename="shopping_cart.csv"')
-        writer = csv.writer(response)
-        ingredient_dict = {}
-
-        for item in shopping_cart_items:
-            recipe = item.recipe
-            ingredients_in_recipe = IngredientInRecipe.objects.filter(
-                recipe=recipe)
-            for ingredient_in_recipe in ingredients_in_recipe:
-                ingredient_name = ingredient_in_recipe.ingredient.name
-                amount = ingredient_in_recipe.amount
-                if ingredient_name in ingredient_dict:
-                    ingredient_dict[ingredient_name] += amount
-                else:
-                    ingredient_dict[ingredient_name] = amount
-
-        writer.writerow(['Ингредиент', 'Количество', 'Единицы измерения'])
-        for ingredient_name, amount in ingredient_dict.items():
-            ingredient = Ingredient.objects.get(name=ingredient_name)
-            writer.writerow([
-                ingredient_name,
-                amount,
-                ingredient.measurement_unit,
-            ])
-
+        ingredients = (
+            IngredientInRecipe.objects
+            .filter(recipe__carts__user=user)
+            .values(
+                'ingredient',
+                name=F('ingredient__name'),
+                measurement_unit=F('ingredient__measurement_unit'),
+            )
+            .annotate(total=Sum('amount'))
+            .order_by('name', 'measurement_unit')
+        )
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=renderer.media_type,
+        )
+        response['Content-Disposition'] = (
+            'attachment; '
+            f'filename="shopping_cart.{renderer.format}"'
+        )
         return response
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Отдает медиафайл, на который ссылается рецепт.
+    Django только проверяет доступ, а сам файл при MEDIA_ACCEL_REDIRECT
+    отдает nginx по заголовку X-Accel-Redirect. Файлы с именем из хеша
+    содержимого не меняются и кешируются навсегда. Ссылка на файл
+    проверяется одним запросом по индексу таблицы RecipeFile.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path) or not is_referenced(path):
+        raise Http404
+    if settings.MEDIA_ACCEL_REDIRECT:
+        content_type, _ = mimetypes.guess_type(path)
+        response = HttpResponse(
+            content_type=content_type or 'application/octet-stream')
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(path))
+    else:
+        response = FileResponse(open(full_path, 'rb'))
+    if is_hashed_name(path):
+        response['Cache-Control'] = (
+            f'public, max-age={settings.MEDIA_IMMUTABLE_MAX_AGE}, immutable')
+    else:
+        patch_cache_control(
+            response, public=True, max_age=settings.MEDIA_MAX_AGE)
+    return response
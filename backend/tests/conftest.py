@@ -1,6 +1,7 @@
 """Конфигурация pytest"""
 import shutil
 from pathlib import Path
+from types import SimpleNamespace
 
 import pytest
 
@@ -26,9 +27,80 @@ def cleanup_media_files():
                 shutil.rmtree(items)
 
 
+@pytest.fixture(autouse=True)
+def reset_caches():
+    """Сброс кеша ответов и индекса поиска ингредиентов между тестами."""
+    from django.core.cache import cache
+    from recipes.search import ingredient_index
+    cache.clear()
+    ingredient_index.invalidate()
+    yield
+    cache.clear()
+    ingredient_index.invalidate()
+
+
 @pytest.fixture
 def test_image_base64():
     """Фикстура тестового изображения."""
     b64 = 'iVBORw0KGgoAAAANSUhEUgAAAAoAAAAKCAYAAACNMs+9AAAAGElEQ'
     b64 += 'VR4nGP8z8Dwn4EIwESMolGF1FMIAD2cAhK2AyPVAAAAAElFTkSuQmCC'
     return b64
+
+
+@pytest.fixture
+def seed_recipes(db):
+    """
+    Фабрика заполненной базы для замеров и планов запросов: авторы
+    с рецептами, теги и ингредиенты рецептов. Записи вставляются
+    пачками, маски и массивы тегов заполняются сразу.
+    """
+    from recipes.fulltext import index_recipes
+    from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
+    from recipes.tagsets import update_tag_ids
+    from users.models import User
+
+    def seed(authors_count, recipes_per_author, tags_count,
+             ingredients_count, amounts, owner=None):
+        """
+        Создает authors_count авторов по recipes_per_author рецептов;
+        owner, если указан, получает столько же рецептов первым.
+        """
+        authors = User.objects.bulk_create(
+            User(username=f'author{i}', email=f'author{i}@example.com',
+                 first_name='Автор', last_name=str(i),
+                 recipes_count=recipes_per_author)
+            for i in range(authors_count)
+        )
+        tags = [Tag(name=f'Тег {i}', color='#FF0000', slug=f'tag-{i}')
+                for i in range(tags_count)]
+        Tag.assign_masks(tags)
+        tags = Tag.objects.bulk_create(tags)
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {i}', measurement_unit='г')
+            for i in range(ingredients_count)
+        )
+        owners = [owner, *authors] if owner else authors
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {i}', text='Описание',
+                   cooking_time=10, tags_mask=tags[i % tags_count].mask)
+            for author in owners for i in range(recipes_per_author)
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(
+                recipe=recipe, tag=tags[i % recipes_per_author % tags_count])
+            for i, recipe in enumerate(recipes)
+        )
+        update_tag_ids(Recipe.objects.all())
+        index_recipes(recipes)
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
+                recipe=recipe, amount=10,
+                ingredient=ingredients[(i + j) % ingredients_count])
+            for i, recipe in enumerate(recipes)
+            for j in range(amounts)
+        )
+        return SimpleNamespace(
+            authors=authors, tags=tags, ingredients=ingredients,
+            recipes=recipes)
+
+    return seed
@@ -1,9 +1,19 @@
 """Тесты API приложения recipes и users."""
 
+import base64
+import io
+import json
+
 import pytest
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import (SimpleUploadedFile,
+                                            TemporaryUploadedFile)
+from django.core.management import call_command
+from PIL import Image
 
 from rest_framework import status
 
+from recipes.images import generate_renditions
 from recipes.models import Recipe, RecipesFavorite, ShoppingCart
 
 pytestmark = pytest.mark.django_db
@@ -70,6 +80,19 @@ class TestUserAPI:
         response = api_client.post('/api/users/', data)
         assert response.status_code == status.HTTP_400_BAD_REQUEST
 
+    def test_user_list_is_subscribed(
+            self, authenticated_client, user2, admin_user, follow,
+            django_assert_max_num_queries):
+        """Признак подписки в списке пользователей без лишних запросов."""
+        with django_assert_max_num_queries(3):
+            response = authenticated_client.get('/api/users/')
+        subscribed = {
+            item['id']: item['is_subscribed']
+            for item in response.data['results']
+        }
+        assert subscribed[user2.id] is True
+        assert subscribed[admin_user.id] is False
+
 
 class TestAuthAPI:
     """Тесты API аутентификации."""
@@ -136,6 +159,48 @@ class TestFollowAPI:
         response = authenticated_client.delete(url)
         assert response.status_code == status.HTTP_204_NO_CONTENT
 
+    def test_subscriptions_recipes_limit(
+            self, authenticated_client, user2, follow,
+            django_assert_max_num_queries):
+        """Проверка ограничения рецептов и их количества в подписках."""
+        for i in range(5):
+            Recipe.objects.create(
+                author=user2, name=f'Рецепт {i}', text='Описание',
+                cooking_time=10)
+        call_command('recalculate_counters')
+        url = '/api/users/subscriptions/'
+        with django_assert_max_num_queries(4):
+            response = authenticated_client.get(url, {'recipes_limit': 3})
+        assert response.status_code == status.HTTP_200_OK
+        author = response.data['results'][0]
+        assert author['recipes_count'] == 5
+        assert len(author['recipes']) == 3
+        assert author['is_subscribed'] is True
+        assert author['recipes'][0]['name'] == 'Рецепт 4'
+
+    def test_subscriptions_query_count(
+            self, authenticated_client, user, django_assert_max_num_queries):
+        """Число запросов к подпискам не зависит от числа авторов."""
+        from users.models import Follow, User
+        for i in range(10):
+            author = User.objects.create_user(
+                email=f'author{i}@test.com', username=f'author{i}',
+                first_name='Author', last_name=str(i), password='pass12345')
+            Follow.objects.create(user=user, author=author)
+            for j in range(4):
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {j}', text='Описание',
+                    cooking_time=10)
+        call_command('recalculate_counters')
+        url = '/api/users/subscriptions/'
+        with django_assert_max_num_queries(4):
+            response = authenticated_client.get(url, {'recipes_limit': 3})
+        assert len(response.data['results']) == 10
+        assert all(
+            len(item['recipes']) == 3 and item['recipes_count'] == 4
+            for item in response.data['results']
+        )
+
 
 class TestTagAPI:
     """Тесты API тегов."""
@@ -185,6 +250,108 @@ class TestIngredientAPI:
         response = api_client.get('/api/ingredients/', data={'name': 'Яйц'})
         assert response.status_code == status.HTTP_200_OK
 
+    def test_ingredient_search_prefix_first(self, api_client):
+        """Совпадения по началу названия выводятся первыми."""
+        from recipes.models import Ingredient
+        Ingredient.objects.bulk_create([
+            Ingredient(name='Сахар', measurement_unit='г'),
+            Ingredient(name='Ванильный сахар', measurement_unit='г'),
+            Ingredient(name='сахарная пудра', measurement_unit='г'),
+            Ingredient(name='Соль', measurement_unit='г'),
+        ])
+        response = api_client.get('/api/ingredients/', {'name': 'САХ'})
+        assert response.status_code == status.HTTP_200_OK
+        names = [item['name'] for item in response.data]
+        assert names == ['Сахар', 'сахарная пудра', 'Ванильный сахар']
+
+    def test_ingredient_search_yo(self, api_client):
+        """Буквы «е» и «ё» в поиске не различаются."""
+        from recipes.models import Ingredient
+        Ingredient.objects.create(name='Свёкла', measurement_unit='г')
+        response = api_client.get('/api/ingredients/', {'name': 'свек'})
+        assert [item['name'] for item in response.data] == ['Свёкла']
+
+    def test_ingredient_search_limit(self, api_client, settings):
+        """Количество найденных ингредиентов ограничено."""
+        from recipes.models import Ingredient
+        settings.INGREDIENT_SEARCH_LIMIT = 3
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Перец {i}', measurement_unit='г')
+            for i in range(10)
+        )
+        response = api_client.get('/api/ingredients/', {'name': 'пер'})
+        assert len(response.data) == 3
+
+    def test_ingredient_search_index_refresh(self, api_client, ingredient):
+        """Индекс обновляется после добавления ингредиента."""
+        from recipes.models import Ingredient
+        api_client.get('/api/ingredients/', {'name': 'Яй'})
+        Ingredient.objects.create(name='Яйцо перепелиное',
+                                  measurement_unit='шт')
+        response = api_client.get('/api/ingredients/', {'name': 'Яй'})
+        assert len(response.data) == 2
+
+    def test_ingredient_search_substring(self, api_client):
+        """Совпадения в середине названия находятся по n-граммам."""
+        from recipes.models import Ingredient
+        names = ['Мука пшеничная', 'Пшено', 'Крупа пшенная', 'Соль',
+                 'Сок лимона', 'Лимон', 'Цедра лимона', 'Мак']
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г') for name in names)
+        for query in ('пшен', 'пше', 'лимона', 'о', 'ак', 'ы'):
+            response = api_client.get('/api/ingredients/', {'name': query})
+            expected = sorted(
+                (name for name in names if query in name.lower()),
+                key=lambda name: (not name.lower().startswith(query),
+                                  name.lower()))
+            assert [item['name'] for item in response.data] == expected
+
+    def test_ingredient_search_shared_version(self, api_client, ingredient):
+        """Индекс перестраивается при смене общей версии справочника."""
+        from recipes.cache import bump_version
+        from recipes.models import Ingredient
+        api_client.get('/api/ingredients/', {'name': 'Яй'})
+        # bulk_create не отправляет сигналы, как изменение в другом
+        # процессе, о котором известно только по версии.
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='Яйцо утиное', measurement_unit='шт')])
+        response = api_client.get('/api/ingredients/', {'name': 'Яй'})
+        assert len(response.data) == 1
+        bump_version('ingredients')
+        response = api_client.get('/api/ingredients/', {'name': 'Яй'})
+        assert len(response.data) == 2
+
+    def test_ingredient_search_change_during_build(
+            self, ingredient, django_assert_num_queries):
+        """Изменение во время построения индекса не теряется."""
+        from django.db import connection
+        from recipes.cache import bump_version
+        from recipes.search import ingredient_index
+
+        def change(execute, sql, params, many, context):
+            connection.execute_wrappers.remove(change)
+            bump_version('ingredients')
+            return execute(sql, params, many, context)
+
+        connection.execute_wrappers.append(change)
+        ingredient_index.search('Яй', 10)
+        with django_assert_num_queries(1):
+            ingredient_index.search('Яй', 10)
+        with django_assert_num_queries(0):
+            ingredient_index.search('Яй', 10)
+
+    def test_ingredient_search_db_backend(
+            self, api_client, ingredient, settings):
+        """Поиск через базу данных выводит совпадения по началу первыми."""
+        from recipes.models import Ingredient
+        settings.INGREDIENT_SEARCH_BACKEND = 'db'
+        Ingredient.objects.create(name='Белок яйца', measurement_unit='г')
+        Ingredient.objects.create(name='Яйцо перепелиное',
+                                  measurement_unit='шт')
+        response = api_client.get('/api/ingredients/', {'name': 'Яйц'})
+        names = [item['name'] for item in response.data]
+        assert names[:2] == ['Яйцо', 'Яйцо перепелиное']
+
 
 class TestRecipeAPI:
     """Тесты API рецептов."""
@@ -221,6 +388,47 @@ class TestRecipeAPI:
         assert response.status_code == status.HTTP_201_CREATED, response.data
         assert response.data['name'] == 'Новый рецепт'
 
+    def test_recipe_create_query_count(
+            self, authenticated_client, tag, tag2, test_image_base64,
+            django_assert_max_num_queries):
+        """Создание рецепта с 20 ингредиентами без запросов на каждый."""
+        from recipes.models import Ingredient
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {i}', measurement_unit='г')
+            for i in range(20)
+        )
+        data = {
+            'ingredients': [
+                {'id': item.id, 'amount': 10} for item in ingredients
+            ],
+            'tags': [tag.id, tag2.id],
+            'name': 'Большой рецепт',
+            'text': 'Описание',
+            'cooking_time': 30,
+            'image': f'data:image/png;base64,{test_image_base64}',
+        }
+        with django_assert_max_num_queries(17):
+            response = authenticated_client.post(
+                '/api/recipes/', data, format='json')
+        assert response.status_code == status.HTTP_201_CREATED, response.data
+        assert len(response.data['ingredients']) == 20
+
+    def test_recipe_create_unknown_ingredient(
+            self, authenticated_client, tag, test_image_base64):
+        """Проверка ошибки при создании рецепта с несуществующим id."""
+        data = {
+            'ingredients': [{'id': 999, 'amount': 2}],
+            'tags': [tag.id],
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 30,
+            'image': f'data:image/png;base64,{test_image_base64}',
+        }
+        response = authenticated_client.post(
+            '/api/recipes/', data, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'ingredients' in response.data
+
     def test_recipe_create_without_auth(self, api_client, tag):
         """Проверка запрета создания рецепта без авторизации."""
         data = {
@@ -277,6 +485,39 @@ class TestRecipeAPI:
         assert response.status_code == status.HTTP_200_OK, response.data
         assert response.data['name'] == 'Обновленный рецепт'
 
+    def test_recipe_update_ingredients_diff(
+            self, authenticated_client, recipe, tag, tag2, ingredient,
+            ingredient2, ingredient_salt, test_image_base64):
+        """Обновление ингредиентов изменяет только отличающиеся записи."""
+        from recipes.models import IngredientInRecipe
+        IngredientInRecipe.objects.create(
+            recipe=recipe, ingredient=ingredient2, amount=100)
+        kept = IngredientInRecipe.objects.get(
+            recipe=recipe, ingredient=ingredient)
+        data = {
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 3},
+                {'id': ingredient_salt.id, 'amount': 5},
+            ],
+            'tags': [tag.id, tag2.id],
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'image': f'data:image/png;base64,{test_image_base64}',
+        }
+        url = f'/api/recipes/{recipe.id}/'
+        response = authenticated_client.put(url, data, format='json')
+        assert response.status_code == status.HTTP_200_OK, response.data
+        amounts = dict(
+            IngredientInRecipe.objects.filter(recipe=recipe)
+            .values_list('ingredient_id', 'amount')
+        )
+        assert amounts == {ingredient.id: 3, ingredient_salt.id: 5}
+        assert IngredientInRecipe.objects.filter(pk=kept.pk).exists()
+        assert set(recipe.tags.values_list('id', flat=True)) == {
+            tag.id, tag2.id}
+        assert len(response.data['ingredients']) == 2
+
     def test_recipe_update_by_non_author(
             self, api_client, user2, recipe, tag):
         """Проверка запрета изменения рецепта не автором."""
@@ -317,15 +558,152 @@ class TestRecipeAPI:
         response = api_client.get('/api/recipes/', {'tag': tag.slug})
         assert response.status_code == status.HTTP_200_OK
 
-    def test_recipe_filter_by_is_favorited(self, authenticated_client, recipe):
+    def test_recipe_filter_by_tags_mode(
+            self, api_client, user, tag, tag2):
+        """Фильтр по нескольким тегам: любой из них или все сразу."""
+        both, first, second = (
+            Recipe.objects.create(
+                author=user, name=name, text='Текст', cooking_time=10)
+            for name in ('Оба', 'Первый', 'Второй')
+        )
+        both.tags.set([tag, tag2])
+        first.tags.set([tag])
+        second.tags.set([tag2])
+        slugs = [tag.slug, tag2.slug]
+
+        def names(**params):
+            response = api_client.get(
+                '/api/recipes/', {'tags': slugs, **params})
+            assert response.status_code == status.HTTP_200_OK
+            return [item['name'] for item in response.data['results']]
+
+        assert sorted(names()) == ['Второй', 'Оба', 'Первый']
+        assert sorted(names(tags_mode='any')) == ['Второй', 'Оба', 'Первый']
+        assert names(tags_mode='all') == ['Оба']
+        response = api_client.get(
+            '/api/recipes/', {'tags': slugs, 'tags_mode': 'some'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_recipe_filter_by_is_favorited(
+            self, authenticated_client, user, recipe):
         """Проверка фильтрации рецептов по-избранному."""
-        user = authenticated_client.handler._force_user
         RecipesFavorite.objects.create(recipe=recipe, user=user)
         response = authenticated_client.get(
             '/api/recipes/', {'is_favorited': 1}
         )
         assert response.status_code == status.HTTP_200_OK
 
+    def test_recipe_cursor_pagination(
+            self, api_client, user, django_assert_max_num_queries):
+        """Проверка обхода рецептов по курсору без запроса COUNT."""
+        for i in range(7):
+            Recipe.objects.create(
+                author=user, name=f'Рецепт {i}', text='Описание',
+                cooking_time=10)
+        response = api_client.get(
+            '/api/recipes/', {'cursor': '', 'limit': 3})
+        assert response.status_code == status.HTTP_200_OK
+        assert 'count' not in response.data
+        names = [item['name'] for item in response.data['results']]
+        next_url = response.data['next']
+        while next_url:
+            with django_assert_max_num_queries(5) as context:
+                response = api_client.get(next_url)
+            assert not any(
+                '__count' in query['sql']
+                for query in context.captured_queries)
+            names += [item['name'] for item in response.data['results']]
+            next_url = response.data['next']
+        assert names == [f'Рецепт {i}' for i in range(6, -1, -1)]
+
+    def test_recipe_cursor_same_pub_date(self, api_client, user):
+        """
+        Курсор обходит рецепты с одинаковой датой публикации вперед
+        и назад без пропусков и повторов.
+        """
+        for i in range(7):
+            Recipe.objects.create(
+                author=user, name=f'Рецепт {i}', text='Описание',
+                cooking_time=10)
+        Recipe.objects.update(pub_date=Recipe.objects.first().pub_date)
+        pages = []
+        url, params = '/api/recipes/', {'cursor': '', 'limit': 3}
+        while url:
+            response = api_client.get(url, params)
+            assert response.status_code == status.HTTP_200_OK
+            pages.append([item['id'] for item in response.data['results']])
+            url, params = response.data['next'], None
+        ids = list(Recipe.objects.order_by('-id').values_list(
+            'id', flat=True))
+        assert pages == [ids[:3], ids[3:6], ids[6:]]
+        previous = response.data['previous']
+        response = api_client.get(previous)
+        assert [item['id'] for item in response.data['results']] == ids[3:6]
+        response = api_client.get(response.data['previous'])
+        assert [item['id'] for item in response.data['results']] == ids[:3]
+        assert response.data['previous'] is None
+
+    def test_recipe_cursor_with_search(self, api_client, recipe):
+        """Курсор нельзя сочетать с поиском по релевантности."""
+        response = api_client.get(
+            '/api/recipes/', {'cursor': '', 'search': 'омлет'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'cursor' in response.data
+
+    def test_recipe_cursor_invalid(self, api_client, recipe):
+        """Поддельный курсор дает 404, а не ошибку сервера."""
+        cursor = base64.b64encode(b'p=2024-13-45|x').decode()
+        response = api_client.get('/api/recipes/', {'cursor': cursor})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_recipe_pagination_count_cached(
+            self, api_client, recipe, recipe2, user):
+        """Общее количество кешируется отдельно для каждого фильтра."""
+        response = api_client.get('/api/recipes/')
+        assert response.data['count'] == 2
+        Recipe.objects.create(
+            author=user, name='Новый', text='Описание', cooking_time=10)
+        response = api_client.get('/api/recipes/')
+        assert response.data['count'] == 2
+        response = api_client.get('/api/recipes/', {'author': user.id})
+        assert response.data['count'] == 2
+
+    def test_recipe_pagination_count_not_cached(
+            self, api_client, recipe, user, settings):
+        """При нулевом таймауте количество считается каждый раз."""
+        settings.PAGINATION_COUNT_CACHE_TIMEOUT = 0
+        api_client.get('/api/recipes/')
+        Recipe.objects.create(
+            author=user, name='Новый', text='Описание', cooking_time=10)
+        response = api_client.get('/api/recipes/')
+        assert response.data['count'] == 2
+
+    @pytest.mark.parametrize('estimate', [3, 1000])
+    def test_recipe_pagination_estimated_count(
+            self, api_client, user, monkeypatch, estimate):
+        """
+        Оценка количества только выводится в ответе, а страницы
+        проверяются по данным.
+        """
+        from api.v1.pagination import CachedCountPaginator
+        monkeypatch.setattr(
+            CachedCountPaginator, 'estimate_count',
+            staticmethod(lambda queryset: estimate))
+        Recipe.objects.bulk_create(
+            Recipe(author=user, name=f'Рецепт {i}', text='Описание',
+                   cooking_time=10)
+            for i in range(12)
+        )
+        response = api_client.get('/api/recipes/', {'page': 3, 'limit': 5})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == estimate
+        assert len(response.data['results']) == 2
+        assert response.data['next'] is None
+        response = api_client.get('/api/recipes/', {'page': 2, 'limit': 5})
+        assert response.data['next'] is not None
+        response = api_client.get('/api/recipes/', {'page': 4, 'limit': 5})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
     def test_recipe_pagination(self, api_client, user, tag, ingredient):
         """Проверка пагинации рецептов."""
         for i in range(15):
@@ -341,6 +719,305 @@ class TestRecipeAPI:
         assert 'results' in response.data
         assert len(response.data['results']) <= 10
 
+    def test_recipe_list_user_flags(
+            self, authenticated_client, user, recipe, recipe2):
+        """Проверка признаков избранного и корзины в списке рецептов."""
+        RecipesFavorite.objects.create(user=user, recipe=recipe)
+        ShoppingCart.objects.create(user=user, recipe=recipe2)
+        response = authenticated_client.get('/api/recipes/')
+        flags = {
+            item['id']: (item['is_favorited'], item['is_in_shopping_cart'])
+            for item in response.data['results']
+        }
+        assert flags == {recipe.id: (True, False), recipe2.id: (False, True)}
+
+    def test_recipe_list_user_flags_anonymous(self, api_client, recipe):
+        """Для анонима признаки избранного и корзины ложны."""
+        response = api_client.get('/api/recipes/')
+        item = response.data['results'][0]
+        assert item['is_favorited'] is False
+        assert item['is_in_shopping_cart'] is False
+
+    def test_recipe_filter_is_in_shopping_cart(
+            self, authenticated_client, user, recipe, recipe2):
+        """Проверка фильтрации рецептов по наличию в корзине."""
+        ShoppingCart.objects.create(user=user, recipe=recipe2)
+        response = authenticated_client.get(
+            '/api/recipes/', {'is_in_shopping_cart': 1}
+        )
+        ids = [item['id'] for item in response.data['results']]
+        assert ids == [recipe2.id]
+
+    def test_recipe_list_query_count(
+            self, api_client, user, user2, tag, tag2, ingredient,
+            ingredient2, django_assert_max_num_queries):
+        """Число запросов к списку рецептов не зависит от их количества."""
+        from recipes.models import IngredientInRecipe
+        for i in range(10):
+            r = Recipe.objects.create(
+                author=user if i % 2 else user2,
+                name=f'Рецепт {i}',
+                text='Описание',
+                cooking_time=10
+            )
+            r.tags.add(tag, tag2)
+            IngredientInRecipe.objects.create(
+                recipe=r, ingredient=ingredient, amount=1)
+            IngredientInRecipe.objects.create(
+                recipe=r, ingredient=ingredient2, amount=2)
+        with django_assert_max_num_queries(5):
+            response = api_client.get('/api/recipes/')
+        assert len(response.data['results']) == 10
+        assert len(response.data['results'][0]['ingredients']) == 2
+        assert len(response.data['results'][0]['tags']) == 2
+        api_client.force_authenticate(user=user)
+        with django_assert_max_num_queries(6):
+            response = api_client.get('/api/recipes/')
+        assert len(response.data['results']) == 10
+
+
+class TestRecipeSearch:
+    """Тесты полнотекстового поиска рецептов."""
+
+    @staticmethod
+    def create(author, name, text):
+        return Recipe.objects.create(
+            author=author, name=name, text=text, cooking_time=10)
+
+    def search(self, client, query):
+        response = client.get('/api/recipes/', {'search': query})
+        assert response.status_code == status.HTTP_200_OK
+        return [item['name'] for item in response.data['results']]
+
+    def test_search_ranked(self, api_client, user):
+        """Совпадение в названии важнее совпадения в описании."""
+        self.create(user, 'Салат', 'Добавить томаты и огурцы')
+        self.create(user, 'Томатный суп', 'Сварить')
+        self.create(user, 'Каша', 'Сварить на молоке')
+        assert self.search(api_client, 'томат') == [
+            'Томатный суп', 'Салат']
+
+    def test_search_all_words(self, api_client, user):
+        """Рецепт должен содержать все слова запроса."""
+        self.create(user, 'Суп гороховый', 'Сварить горох')
+        self.create(user, 'Суп куриный', 'Сварить курицу')
+        assert self.search(api_client, 'суп куриный') == ['Суп куриный']
+
+    def test_search_yo(self, api_client, user):
+        """Буквы «е» и «ё» не различаются."""
+        self.create(user, 'Ёжики из фарша', 'Слепить')
+        assert self.search(api_client, 'ежики') == ['Ёжики из фарша']
+
+    def test_search_updated_and_deleted(
+            self, authenticated_client, recipe, tag, ingredient,
+            test_image_base64):
+        """Поисковый документ обновляется при изменении и удалении."""
+        assert self.search(authenticated_client, 'омлет') == ['Омлет']
+        response = authenticated_client.patch(
+            f'/api/recipes/{recipe.id}/', {
+                'ingredients': [{'id': ingredient.id, 'amount': 2}],
+                'tags': [tag.id],
+                'name': 'Яичница',
+                'text': 'Пожарить',
+                'cooking_time': 5,
+                'image': f'data:image/png;base64,{test_image_base64}',
+            }, format='json')
+        assert response.status_code == status.HTTP_200_OK, response.data
+        assert self.search(authenticated_client, 'омлет') == []
+        assert self.search(authenticated_client, 'яичница') == ['Яичница']
+        authenticated_client.delete(f'/api/recipes/{recipe.id}/')
+        assert self.search(authenticated_client, 'яичница') == []
+
+    def test_search_punctuation(self, api_client, recipe):
+        """Запрос без слов ничего не находит, а пустой не фильтрует."""
+        assert self.search(api_client, '"*(') == []
+        assert self.search(api_client, '') == ['Омлет']
+
+
+class TestRecipeImages:
+    """Тесты производных изображений рецептов."""
+
+    @staticmethod
+    def make_photo():
+        """Большая JPEG-фотография с метаданными EXIF в base64."""
+        image = Image.new('RGB', (2000, 1000), 'orange')
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        return base64.b64encode(buffer.getvalue()).decode()
+
+    def test_create_returns_pending(
+            self, authenticated_client, tag, ingredient, settings):
+        """Рецепт создается сразу, копии строятся после фиксации."""
+        settings.IMAGE_PROCESSING = 'worker'
+        data = {
+            'ingredients': [{'id': ingredient.id, 'amount': 2}],
+            'tags': [tag.id],
+            'name': 'Фото',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': f'data:image/jpeg;base64,{self.make_photo()}',
+        }
+        response = authenticated_client.post(
+            '/api/recipes/', data, format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['image_status'] == 'pending'
+        assert response.data['image'].endswith('.jpg')
+        assert Recipe.objects.get(
+            pk=response.data['id']).image_status == 'pending'
+
+    def test_create_builds_renditions(
+            self, authenticated_client, tag, ingredient, settings,
+            django_capture_on_commit_callbacks):
+        """После фиксации строятся копии без метаданных."""
+        settings.IMAGE_PROCESSING = 'sync'
+        data = {
+            'ingredients': [{'id': ingredient.id, 'amount': 2}],
+            'tags': [tag.id],
+            'name': 'Фото',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': f'data:image/jpeg;base64,{self.make_photo()}',
+        }
+        with django_capture_on_commit_callbacks(execute=True):
+            response = authenticated_client.post(
+                '/api/recipes/', data, format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        response = authenticated_client.get(f'/api/recipes/{recipe.id}/')
+        assert response.data['image_status'] == 'ready'
+        images = response.data['images']
+        assert set(images) == {'thumbnail', 'card', 'full'}
+        assert all(url.endswith('.webp') for url in images.values())
+        assert response.data['image'].endswith(recipe.image.url)
+        response = authenticated_client.get('/api/recipes/')
+        assert response.data['results'][0]['image'] == images['card']
+
+        sizes = {}
+        for name, path in recipe.renditions.items():
+            with recipe.image.storage.open(path) as file:
+                with Image.open(file) as image:
+                    assert image.format == 'WEBP'
+                    assert not image.getexif()
+                    sizes[name] = image.size
+        assert sizes == {
+            'thumbnail': (160, 160), 'card': (600, 300),
+            'full': (1600, 800)}
+
+    def test_original_until_rendered(self, api_client, recipe):
+        """Пока копий нет, отдается адрес оригинала."""
+        response = api_client.get(f'/api/recipes/{recipe.id}/')
+        assert response.data['image'].endswith(recipe.image.url)
+        assert response.data['images']['thumbnail'] == response.data['image']
+
+    def test_pool_receives_file_path(self, recipe, monkeypatch):
+        """В пул передается путь к оригиналу, а не его байты."""
+        from concurrent.futures import Future
+
+        from recipes import tasks
+
+        submitted = []
+
+        class Executor:
+            def submit(self, *args):
+                submitted.append(args)
+                return Future()
+
+        monkeypatch.setattr(tasks, 'get_executor', Executor)
+        tasks.submit_recipe(recipe)
+        assert submitted[0][1] == recipe.image.path
+
+    def test_short_recipe_thumbnail(self, authenticated_client, recipe):
+        """В кратком представлении рецепта отдается миниатюра."""
+        generate_renditions(recipe)
+        response = authenticated_client.post(
+            f'/api/recipes/{recipe.id}/favorite/')
+        assert response.data['image'].endswith(
+            recipe.renditions['thumbnail'])
+
+
+class TestRecipeMultipartUpload:
+    """Тесты загрузки рецепта в формате multipart/form-data."""
+
+    @staticmethod
+    def make_file(name='photo.png', image_format='PNG'):
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48), 'green').save(buffer, image_format)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def test_create_multipart(
+            self, authenticated_client, tag, tag2, ingredient, monkeypatch):
+        """Рецепт создается из полей формы и файла изображения."""
+        uploads = []
+        save = FileSystemStorage._save
+
+        def spy(storage, name, content):
+            uploads.append(content)
+            return save(storage, name, content)
+
+        monkeypatch.setattr(FileSystemStorage, '_save', spy)
+        response = authenticated_client.post('/api/recipes/', {
+            'ingredients': json.dumps([{'id': ingredient.id, 'amount': 3}]),
+            'tags': [tag.id, tag2.id],
+            'name': 'Из формы',
+            'text': 'Описание',
+            'cooking_time': 7,
+            'image': self.make_file(),
+        }, format='multipart')
+        assert response.status_code == status.HTTP_201_CREATED, response.data
+        assert len(response.data['tags']) == 2
+        assert response.data['ingredients'][0]['amount'] == 3
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        assert recipe.image.name.endswith('.png')
+        assert 'photo' not in recipe.image.name
+        assert isinstance(uploads[0], TemporaryUploadedFile)
+
+    def test_update_multipart(
+            self, authenticated_client, recipe, tag, ingredient):
+        """Изображение рецепта заменяется файлом JPEG."""
+        old_image = recipe.image.name
+        response = authenticated_client.patch(
+            f'/api/recipes/{recipe.id}/', {
+                'ingredients': json.dumps(
+                    [{'id': ingredient.id, 'amount': 5}]),
+                'tags': json.dumps([tag.id]),
+                'name': 'Новое имя',
+                'text': 'Описание',
+                'cooking_time': 7,
+                'image': self.make_file('photo.jpeg', 'JPEG'),
+            }, format='multipart')
+        assert response.status_code == status.HTTP_200_OK, response.data
+        recipe.refresh_from_db()
+        assert recipe.image.name != old_image
+        assert recipe.image.name.endswith('.jpg')
+        assert recipe.image_status == 'pending'
+
+    def test_invalid_json_field(self, authenticated_client, tag):
+        """Неверный JSON во вложенном поле дает ошибку 400."""
+        response = authenticated_client.post('/api/recipes/', {
+            'ingredients': '[{"id": ',
+            'tags': [tag.id],
+            'name': 'Ошибка',
+            'text': 'Описание',
+            'cooking_time': 7,
+            'image': self.make_file(),
+        }, format='multipart')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_not_an_image(self, authenticated_client, tag, ingredient):
+        """Файл, не являющийся изображением, отклоняется."""
+        response = authenticated_client.post('/api/recipes/', {
+            'ingredients': json.dumps([{'id': ingredient.id, 'amount': 3}]),
+            'tags': [tag.id],
+            'name': 'Ошибка',
+            'text': 'Описание',
+            'cooking_time': 7,
+            'image': SimpleUploadedFile('photo.png', b'not an image'),
+        }, format='multipart')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'image' in response.data
+
 
 class TestShoppingCartAPI:
     """Тесты API списка покупок."""
@@ -374,6 +1051,63 @@ class TestShoppingCartAPI:
         assert response.status_code == status.HTTP_204_NO_CONTENT
         assert not ShoppingCart.objects.filter(recipe=recipe).exists()
 
+    def test_cart_counter(self, authenticated_client, recipe):
+        """Счетчик корзины меняется при добавлении и удалении."""
+        url = f'/api/recipes/{recipe.id}/shopping_cart/'
+        authenticated_client.post(url)
+        authenticated_client.post(url)
+        recipe.refresh_from_db()
+        assert recipe.carts_count == 1
+        authenticated_client.delete(url)
+        authenticated_client.delete(url)
+        recipe.refresh_from_db()
+        assert recipe.carts_count == 0
+
+
+class TestCounters:
+    """Тесты денормализованных счетчиков."""
+
+    def test_favorite_counter(self, authenticated_client, recipe):
+        """Счетчик избранного меняется при добавлении и удалении."""
+        url = f'/api/recipes/{recipe.id}/favorite/'
+        authenticated_client.post(url)
+        recipe.refresh_from_db()
+        assert recipe.favorites_count == 1
+        authenticated_client.delete(url)
+        recipe.refresh_from_db()
+        assert recipe.favorites_count == 0
+
+    def test_recipes_counter(
+            self, authenticated_client, user, tag, ingredient,
+            test_image_base64):
+        """Счетчик рецептов автора меняется при создании и удалении."""
+        data = {
+            'ingredients': [{'id': ingredient.id, 'amount': 2}],
+            'tags': [tag.id],
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': f'data:image/png;base64,{test_image_base64}',
+        }
+        response = authenticated_client.post(
+            '/api/recipes/', data, format='json')
+        user.refresh_from_db()
+        assert user.recipes_count == 1
+        authenticated_client.delete(f'/api/recipes/{response.data["id"]}/')
+        user.refresh_from_db()
+        assert user.recipes_count == 0
+
+    def test_followers_counter(self, authenticated_client, user2):
+        """Счетчик подписчиков меняется при подписке и отписке."""
+        url = f'/api/users/{user2.id}/subscribe/'
+        authenticated_client.post(url)
+        user2.refresh_from_db()
+        assert user2.followers_count == 1
+        authenticated_client.delete(url)
+        authenticated_client.delete(url)
+        user2.refresh_from_db()
+        assert user2.followers_count == 0
+
 
 class TestDownloadShoppingCart:
     """Тесты API загрузки списка покупок."""
@@ -391,12 +1125,80 @@ class TestDownloadShoppingCart:
         assert response['Content-Type'] == 'text/csv'
 
     def test_download_cart_with_recipes(
-            self, authenticated_client, recipe):
+            self, authenticated_client, user, recipe):
         """Проверка загрузки списка покупок с рецептами."""
-        user = authenticated_client.handler._force_user
         ShoppingCart.objects.create(user=user, recipe=recipe)
         url = '/api/recipes/download_shopping_cart/'
         response = authenticated_client.get(url)
         assert response.status_code == status.HTTP_200_OK
         assert 'attachment' in response['Content-Disposition']
         assert 'shopping_cart.csv' in response['Content-Disposition']
+
+    def test_download_cart_sums_amounts(
+            self, authenticated_client, user, recipe, user2, ingredient):
+        """Проверка суммирования ингредиентов из разных рецептов."""
+        from recipes.models import IngredientInRecipe
+        other = Recipe.objects.create(
+            author=user2, name='Яичница', text='Пожарить', cooking_time=5)
+        IngredientInRecipe.objects.create(
+            recipe=other, ingredient=ingredient, amount=3)
+        ShoppingCart.objects.create(user=user, recipe=recipe)
+        ShoppingCart.objects.create(user=user, recipe=other)
+        url = '/api/recipes/download_shopping_cart/'
+        response = authenticated_client.get(url)
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        assert rows[1:] == ['Яйцо,5,шт']
+
+    def test_download_cart_same_name_different_units(
+            self, authenticated_client, user, recipe):
+        """Одноименные ингредиенты с разными единицами не объединяются."""
+        from recipes.models import Ingredient, IngredientInRecipe
+        eggs_gram = Ingredient.objects.create(
+            name='Яйцо', measurement_unit='г')
+        IngredientInRecipe.objects.create(
+            recipe=recipe, ingredient=eggs_gram, amount=100)
+        ShoppingCart.objects.create(user=user, recipe=recipe)
+        url = '/api/recipes/download_shopping_cart/'
+        response = authenticated_client.get(url)
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        assert sorted(rows[1:]) == ['Яйцо,100,г', 'Яйцо,2,шт']
+
+    def test_download_cart_constant_queries(
+            self, authenticated_client, user, recipe, recipe2,
+            django_assert_max_num_queries):
+        """Число запросов не зависит от размера корзины."""
+        ShoppingCart.objects.create(user=user, recipe=recipe)
+        ShoppingCart.objects.create(user=user, recipe=recipe2)
+        url = '/api/recipes/download_shopping_cart/'
+        with django_assert_max_num_queries(1):
+            response = authenticated_client.get(url)
+            b''.join(response.streaming_content)
+
+    @pytest.mark.parametrize('fmt, content_type', [
+        ('csv', 'text/csv'),
+        ('json', 'application/json'),
+        ('txt', 'text/plain'),
+    ])
+    def test_download_cart_formats(
+            self, authenticated_client, user, recipe, fmt, content_type):
+        """Проверка выгрузки списка покупок в разных форматах."""
+        ShoppingCart.objects.create(user=user, recipe=recipe)
+        url = '/api/recipes/download_shopping_cart/'
+        response = authenticated_client.get(url, {'format': fmt})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.streaming
+        assert response['Content-Type'] == content_type
+        assert f'shopping_cart.{fmt}' in response['Content-Disposition']
+        content = b''.join(response.streaming_content).decode()
+        assert 'Яйцо' in content
+
+    def test_download_cart_json_content(
+            self, authenticated_client, user, recipe):
+        """Проверка содержимого списка покупок в формате JSON."""
+        ShoppingCart.objects.create(user=user, recipe=recipe)
+        url = '/api/recipes/download_shopping_cart/'
+        response = authenticated_client.get(url, {'format': 'json'})
+        content = b''.join(response.streaming_content).decode()
+        assert json.loads(content) == [
+            {'name': 'Яйцо', 'amount': 2, 'measurement_unit': 'шт'}
+        ]
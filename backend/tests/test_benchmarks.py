@@ -0,0 +1,381 @@
+"""
+Замеры эндпоинтов API: время ответа, число запросов и память.
+
+Каждый эндпоинт из api/v1/urls.py вызывается анонимом и авторизованным
+пользователем на базах трех размеров (SIZES). Для каждого вызова
+измеряются время ответа, число запросов к базе и пик выделенной
+памяти (tracemalloc включен на время запроса, поэтому время
+сравнимо только с замерами, сделанными так же).
+
+Бюджет запросов проверяется при каждом прогоне тестов
+(test_query_budget): каждый эндпоинт вызывается на базе среднего
+размера, и тест падает, если число запросов превышает бюджет (бюджет
+не зависит от числа объектов, поэтому N+1 его превышает).
+
+Замеры на всех размерах базы (test_endpoint) зависят от машины,
+поэтому помечены benchmark и по умолчанию не запускаются (см.
+addopts в pytest.ini). Они падают, если число запросов больше
+зафиксированного, а время или память больше зафиксированных значений
+в BENCHMARK_TOLERANCE раз (по умолчанию 3):
+
+    pytest -m benchmark tests/test_benchmarks.py
+
+Зафиксированные значения хранятся в benchmarks.json рядом с тестом.
+Обновить их после намеренного изменения:
+
+    BENCHMARK_UPDATE=1 pytest -m benchmark tests/test_benchmarks.py
+"""
+import json
+import os
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.v1.urls import router
+from recipes.models import RecipesFavorite, ShoppingCart
+from recipes.search import ingredient_index
+from users.models import Follow
+
+pytestmark = pytest.mark.django_db
+
+BASELINES_FILE = Path(__file__).with_name('benchmarks.json')
+UPDATE = bool(os.getenv('BENCHMARK_UPDATE'))
+TOLERANCE = float(os.getenv('BENCHMARK_TOLERANCE', 3))
+# Запас на шум для очень быстрых ответов и мелких выделений памяти.
+TIME_SLACK_MS = 25
+MEMORY_SLACK_KB = 256
+
+# Размер базы: число авторов и рецептов у каждого автора.
+SIZES = {
+    'small': (3, 4),
+    'medium': (12, 10),
+    'large': (40, 25),
+}
+ROLES = ('anonymous', 'authenticated')
+
+IMAGE = 'data:image/png;base64,' + (
+    'iVBORw0KGgoAAAANSUhEUgAAAAoAAAAKCAYAAACNMs+9AAAAGElEQVR4nGP8'
+    'z8Dwn4EIwESMolGF1FMIAD2cAhK2AyPVAAAAAElFTkSuQmCC'
+)
+
+# Маршруты роутера, которые не входят в API Foodgram: почтовые
+# сценарии djoser и изменение пользователей не используются,
+# а PUT рецепта обрабатывается тем же методом, что и PATCH.
+EXCLUDED_ROUTES = {
+    ('users-activation', 'post'),
+    ('users-resend-activation', 'post'),
+    ('users-reset-password', 'post'),
+    ('users-reset-password-confirm', 'post'),
+    ('users-reset-username', 'post'),
+    ('users-reset-username-confirm', 'post'),
+    ('users-set-username', 'post'),
+    ('users-detail', 'put'),
+    ('users-detail', 'patch'),
+    ('users-detail', 'delete'),
+    ('recipes-detail', 'put'),
+}
+
+
+def seed(seed_recipes, user, authors_count, recipes_per_author):
+    """
+    Заполняет базу: авторы с рецептами, подписки, избранное и корзина
+    пользователя растут вместе с размером базы.
+    """
+    data = seed_recipes(authors_count, recipes_per_author, tags_count=4,
+                        ingredients_count=100, amounts=4, owner=user)
+    authors, recipes = data.authors, data.recipes
+    others = recipes[recipes_per_author:]
+    Follow.objects.bulk_create(
+        Follow(user=user, author=author) for author in authors[:-1])
+    RecipesFavorite.objects.bulk_create(
+        RecipesFavorite(user=user, recipe=recipe) for recipe in others[::3])
+    ShoppingCart.objects.bulk_create(
+        ShoppingCart(user=user, recipe=recipe) for recipe in others[::5])
+    return SimpleNamespace(
+        user=user,
+        own_recipe=recipes[0],
+        recipe=others[1],
+        favorited=others[0],
+        followed=authors[0],
+        not_followed=authors[-1],
+        tag=data.tags[0],
+        ingredient=data.ingredients[0],
+    )
+
+
+def recipe_payload(data):
+    return {
+        'ingredients': [{'id': data.ingredient.id, 'amount': 5}],
+        'tags': [data.tag.id],
+        'image': IMAGE,
+        'name': 'Новый рецепт',
+        'text': 'Описание',
+        'cooking_time': 15,
+    }
+
+
+# Эндпоинт: маршрут и HTTP-метод, адрес и тело запроса, ожидаемые
+# статусы анонима и пользователя, бюджет запросов к базе.
+CASES = {
+    'api-root': dict(
+        route=('api-root', 'get'), url=lambda data: '/api/',
+        statuses=(200, 200), budget=0),
+    'users-list': dict(
+        route=('users-list', 'get'), url=lambda data: '/api/users/',
+        statuses=(200, 200), budget=3),
+    'users-create': dict(
+        route=('users-list', 'post'), url=lambda data: '/api/users/',
+        payload=lambda data: {
+            'email': 'new@example.com', 'username': 'newuser',
+            'first_name': 'Новый', 'last_name': 'Пользователь',
+            'password': 'Sup3r-secret-pass'},
+        statuses=(201, 201), budget=4),
+    'users-retrieve': dict(
+        route=('users-detail', 'get'),
+        url=lambda data: f'/api/users/{data.followed.id}/',
+        statuses=(200, 200), budget=2),
+    'users-me': dict(
+        route=('users-me', 'get'), url=lambda data: '/api/users/me/',
+        statuses=(401, 200), budget=1),
+    'users-set-password': dict(
+        route=('users-set-password', 'post'),
+        url=lambda data: '/api/users/set_password/',
+        payload=lambda data: {
+            'current_password': 'testpass123',
+            'new_password': 'An0ther-secret-pass'},
+        statuses=(401, 204), budget=1),
+    'users-subscriptions': dict(
+        route=('users-subscriptions', 'get'),
+        url=lambda data: '/api/users/subscriptions/?recipes_limit=3',
+        statuses=(401, 200), budget=4),
+    'users-subscribe': dict(
+        route=('users-subscribe', 'post'),
+        url=lambda data: f'/api/users/{data.not_followed.id}/subscribe/',
+        statuses=(401, 201), budget=9),
+    'users-unsubscribe': dict(
+        route=('users-subscribe', 'delete'),
+        url=lambda data: f'/api/users/{data.followed.id}/subscribe/',
+        statuses=(401, 204), budget=5),
+    'token-login': dict(
+        route=('login', 'post'), url=lambda data: '/api/auth/token/login/',
+        payload=lambda data: {
+            'email': data.user.email, 'password': 'testpass123'},
+        statuses=(200, 200), budget=6),
+    'token-logout': dict(
+        route=('logout', 'post'), url=lambda data: '/api/auth/token/logout/',
+        statuses=(401, 204), budget=1),
+    'docs': dict(
+        route=('docs', 'get'), url=lambda data: '/api/docs/',
+        statuses=(302, 302), budget=0),
+    'tags-list': dict(
+        route=('tags-list', 'get'), url=lambda data: '/api/tags/',
+        statuses=(200, 200), budget=1),
+    'tags-retrieve': dict(
+        route=('tags-detail', 'get'),
+        url=lambda data: f'/api/tags/{data.tag.id}/',
+        statuses=(200, 200), budget=1),
+    'ingredients-list': dict(
+        route=('ingredients-list', 'get'),
+        url=lambda data: '/api/ingredients/',
+        statuses=(200, 200), budget=1),
+    'ingredients-search': dict(
+        route=('ingredients-list', 'get'),
+        url=lambda data: '/api/ingredients/?name=ингр',
+        statuses=(200, 200), budget=1),
+    'ingredients-retrieve': dict(
+        route=('ingredients-detail', 'get'),
+        url=lambda data: f'/api/ingredients/{data.ingredient.id}/',
+        statuses=(200, 200), budget=1),
+    'recipes-list': dict(
+        route=('recipes-list', 'get'), url=lambda data: '/api/recipes/',
+        statuses=(200, 200), budget=6),
+    'recipes-list-filtered': dict(
+        route=('recipes-list', 'get'),
+        url=lambda data: (
+            f'/api/recipes/?is_favorited=1&tags={data.tag.slug}'),
+        statuses=(200, 200), budget=8),
+    'recipes-create': dict(
+        route=('recipes-list', 'post'), url=lambda data: '/api/recipes/',
+        payload=recipe_payload,
+        statuses=(401, 201), budget=16),
+    'recipes-retrieve': dict(
+        route=('recipes-detail', 'get'),
+        url=lambda data: f'/api/recipes/{data.recipe.id}/',
+        statuses=(200, 200), budget=5),
+    'recipes-update': dict(
+        route=('recipes-detail', 'patch'),
+        url=lambda data: f'/api/recipes/{data.own_recipe.id}/',
+        payload=recipe_payload,
+        statuses=(401, 200), budget=18),
+    'recipes-delete': dict(
+        route=('recipes-detail', 'delete'),
+        url=lambda data: f'/api/recipes/{data.own_recipe.id}/',
+        statuses=(401, 204), budget=13),
+    'recipes-favorite': dict(
+        route=('recipes-favorite', 'post'),
+        url=lambda data: f'/api/recipes/{data.recipe.id}/favorite/',
+        statuses=(401, 201), budget=8),
+    'recipes-unfavorite': dict(
+        route=('recipes-favorite', 'delete'),
+        url=lambda data: f'/api/recipes/{data.favorited.id}/favorite/',
+        statuses=(401, 204), budget=5),
+    'recipes-cart-add': dict(
+        route=('recipes-shopping-cart', 'post'),
+        url=lambda data: f'/api/recipes/{data.recipe.id}/shopping_cart/',
+        statuses=(401, 201), budget=7),
+    'recipes-cart-remove': dict(
+        route=('recipes-shopping-cart', 'delete'),
+        url=lambda data: f'/api/recipes/{data.favorited.id}/shopping_cart/',
+        statuses=(401, 204), budget=5),
+    'recipes-download-cart': dict(
+        route=('recipes-download-shopping-cart', 'get'),
+        url=lambda data: '/api/recipes/download_shopping_cart/',
+        statuses=(401, 200), budget=1),
+}
+
+
+def load_baselines():
+    if BASELINES_FILE.exists():
+        return json.loads(BASELINES_FILE.read_text(encoding='utf-8'))
+    return {}
+
+
+RESULTS = {}
+WARMED_UP = set()
+
+
+@pytest.fixture(scope='module', autouse=True)
+def save_baselines():
+    """В режиме обновления записывает замеры в benchmarks.json."""
+    yield
+    if not UPDATE or not RESULTS:
+        return
+    baselines = load_baselines()
+    for name, roles in RESULTS.items():
+        for role, sizes in roles.items():
+            baselines.setdefault(name, {}).setdefault(role, {}).update(sizes)
+    BASELINES_FILE.write_text(
+        json.dumps(baselines, ensure_ascii=False, indent=2, sort_keys=True)
+        + '\n', encoding='utf-8')
+
+
+def warm_up(client, method, url, payload):
+    """
+    Выполняет запрос с откатом изменений, чтобы в замер не попали
+    импорты и инициализация при первом обращении к эндпоинту.
+    """
+    with transaction.atomic():
+        response = getattr(client, method)(url, payload, format='json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        transaction.set_rollback(True)
+    cache.clear()
+    ingredient_index.invalidate()
+
+
+def measure(client, method, url, payload):
+    """Выполняет запрос и возвращает ответ и его замеры."""
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, payload, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return response, {
+        'queries': len(queries),
+        'time_ms': round(elapsed * 1000, 1),
+        'memory_kb': round(peak / 1024),
+    }
+
+
+def test_all_routes_covered():
+    """Замерами покрыты все маршруты роутера и API."""
+    routes = {
+        (pattern.name, method)
+        for pattern in router.urls
+        for method in getattr(pattern.callback, 'actions', {'get': None})
+        # HEAD обрабатывается тем же методом, что и GET.
+        if method != 'head'
+    }
+    routes |= {('docs', 'get'), ('login', 'post'), ('logout', 'post')}
+    covered = {case['route'] for case in CASES.values()}
+    assert routes - EXCLUDED_ROUTES - covered == set()
+    assert covered - routes == set()
+
+
+def prepare(name, role, size, api_client, user, seed_recipes):
+    """
+    Заполняет базу и возвращает метод, адрес и тело запроса
+    эндпоинта. Первый вызов эндпоинта выполняется с откатом.
+    """
+    case = CASES[name]
+    data = seed(seed_recipes, user, *SIZES[size])
+    if role == 'authenticated':
+        api_client.force_authenticate(user=user)
+    method = case['route'][1]
+    payload = case['payload'](data) if 'payload' in case else None
+    url = case['url'](data)
+    if (name, role) not in WARMED_UP:
+        warm_up(api_client, method, url, payload)
+        WARMED_UP.add((name, role))
+        # Запрос мог изменить объект пользователя (например, пароль).
+        user.refresh_from_db()
+    return method, url, payload
+
+
+def check_budget(name, role, response, queries):
+    """Проверяет статус ответа и число запросов эндпоинта."""
+    case = CASES[name]
+    expected_status = case['statuses'][ROLES.index(role)]
+    assert response.status_code == expected_status, getattr(
+        response, 'data', None)
+    assert queries <= case['budget'], (
+        f'{name}: {queries} запросов при бюджете {case["budget"]}')
+
+
+@pytest.mark.parametrize('role', ROLES)
+@pytest.mark.parametrize('name', CASES)
+def test_query_budget(name, role, api_client, user, seed_recipes):
+    """Число запросов эндпоинта не превышает бюджет."""
+    method, url, payload = prepare(
+        name, role, 'medium', api_client, user, seed_recipes)
+    with CaptureQueriesContext(connection) as queries:
+        response = getattr(api_client, method)(url, payload, format='json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+    check_budget(name, role, response, len(queries))
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('role', ROLES)
+@pytest.mark.parametrize('name', CASES)
+def test_endpoint(name, role, size, api_client, user, seed_recipes):
+    """Замер эндпоинта и сравнение с бюджетом и зафиксированными."""
+    method, url, payload = prepare(
+        name, role, size, api_client, user, seed_recipes)
+    response, result = measure(api_client, method, url, payload)
+    check_budget(name, role, response, result['queries'])
+    RESULTS.setdefault(name, {}).setdefault(role, {})[size] = result
+    if UPDATE:
+        return
+    baseline = load_baselines().get(name, {}).get(role, {}).get(size)
+    assert baseline, (
+        f'{name}: нет зафиксированных замеров, запустите '
+        'с BENCHMARK_UPDATE=1')
+    assert result['queries'] <= baseline['queries']
+    assert result['time_ms'] <= (
+        baseline['time_ms'] * TOLERANCE + TIME_SLACK_MS)
+    assert result['memory_kb'] <= (
+        baseline['memory_kb'] * TOLERANCE + MEMORY_SLACK_KB)
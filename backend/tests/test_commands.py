@@ -0,0 +1,287 @@
+"""Тесты management-команд."""
+
+import io
+import json
+from datetime import timedelta
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.utils import timezone
+
+from recipes.management.commands.import_data import iter_json_array
+from recipes.fulltext import search_recipes
+from recipes.images import generate_renditions
+from recipes.models import (Ingredient, Recipe, RecipesFavorite,
+                            ShoppingCart, Tag)
+from users.models import Follow, User
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Временный корень проекта с папкой data."""
+    (tmp_path / 'data').mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / 'data'
+
+
+class TestImportData:
+    """Тесты команды import_data."""
+
+    def test_import_csv(self, data_dir, capsys):
+        """Проверка загрузки ингредиентов из CSV с дубликатами."""
+        (data_dir / 'ingredients.csv').write_text(
+            'name,measurement_unit\n'
+            'соль,г\n'
+            'сахар,г\n'
+            'соль,г\n'
+            'соль,щепотка\n',
+            encoding='utf-8',
+        )
+        call_command('import_data', batch_size=2)
+        assert set(Ingredient.objects.values_list(
+            'name', 'measurement_unit')) == {
+            ('соль', 'г'), ('сахар', 'г'), ('соль', 'щепотка')}
+        assert 'Загружено 3 записей, пропущено 1.' in capsys.readouterr().out
+
+    def test_import_is_idempotent(self, data_dir, capsys):
+        """Повторный импорт не создает новых записей."""
+        (data_dir / 'ingredients.json').write_text(json.dumps([
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'name': 'перец', 'measurement_unit': 'г'},
+        ]), encoding='utf-8')
+        (data_dir / 'tags.json').write_text(json.dumps([
+            {'name': 'Завтрак', 'color': '#E26C2D', 'slug': 'breakfast'},
+        ]), encoding='utf-8')
+        call_command('import_data')
+        call_command('import_data')
+        assert Ingredient.objects.count() == 2
+        assert Tag.objects.count() == 1
+        assert 'Загружено 0 записей, пропущено 2.' in capsys.readouterr().out
+
+    def test_import_both_files_non_interactive(self, data_dir, monkeypatch):
+        """При наличии CSV и JSON формат выбирается без запроса ввода."""
+        monkeypatch.setattr('builtins.input', pytest.fail)
+        (data_dir / 'ingredients.csv').write_text(
+            'name,measurement_unit\nсоль,г\n', encoding='utf-8')
+        (data_dir / 'ingredients.json').write_text(json.dumps([
+            {'name': 'перец', 'measurement_unit': 'г'},
+        ]), encoding='utf-8')
+        call_command('import_data', format='json')
+        assert list(Ingredient.objects.values_list('name', flat=True)) == [
+            'перец']
+
+    def test_import_from_path(self, data_dir, tmp_path):
+        """Проверка загрузки каталога по явному пути."""
+        catalog = tmp_path / 'catalog.json'
+        catalog.write_text(json.dumps([
+            {'name': f'ингредиент {i}', 'measurement_unit': 'г'}
+            for i in range(50)
+        ]), encoding='utf-8')
+        call_command('import_data', path=str(catalog), batch_size=7)
+        assert Ingredient.objects.count() == 50
+
+
+class TestIterJsonArray:
+    """Тесты потокового разбора JSON-массива."""
+
+    def test_small_chunks(self):
+        """Элементы, разорванные границей фрагмента, собираются целиком."""
+        items = [{'name': 'соль', 'amount': 12345}, 1, 'строка', [1, 2]]
+        data = io.StringIO(' \n' + json.dumps(items, indent=2))
+        assert list(iter_json_array(data, chunk_size=3)) == items
+
+    def test_empty_array(self):
+        """Пустой массив не содержит элементов."""
+        assert list(iter_json_array(io.StringIO('[ ]'))) == []
+
+    def test_truncated_array(self):
+        """Оборванный массив вызывает ошибку."""
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.StringIO('[{"a": 1}, {"b"'), 4))
+
+
+class TestRecalculateCounters:
+    """Тесты команды recalculate_counters."""
+
+    def test_fix_counters(self, user, user2, recipe, capsys):
+        """Счетчики, измененные в обход API, исправляются командой."""
+        RecipesFavorite.objects.create(user=user2, recipe=recipe)
+        Follow.objects.create(user=user2, author=user)
+        User.objects.filter(pk=user2.pk).update(followers_count=3)
+        call_command('recalculate_counters')
+        recipe.refresh_from_db()
+        user.refresh_from_db()
+        user2.refresh_from_db()
+        assert recipe.favorites_count == 1
+        assert recipe.carts_count == 0
+        assert user.recipes_count == 1
+        assert user.followers_count == 1
+        assert user2.followers_count == 0
+        out = capsys.readouterr().out
+        assert 'Recipe.favorites_count: исправлено 1 записей.' in out
+        assert 'User.followers_count: исправлено 2 записей.' in out
+
+    def test_no_changes(self, recipe, capsys):
+        """Повторный пересчет ничего не изменяет."""
+        call_command('recalculate_counters')
+        capsys.readouterr()
+        call_command('recalculate_counters')
+        assert 'исправлено 1' not in capsys.readouterr().out
+
+
+class TestProcessImages:
+    """Тесты команды process_images."""
+
+    def test_process_pending(self, recipe, recipe2, capsys):
+        """Обрабатываются только рецепты в состоянии pending."""
+        generate_renditions(recipe)
+        Recipe.objects.filter(pk=recipe2.pk).update(image_status='pending')
+        call_command('process_images', once=True, workers=0, min_age=0)
+        recipe2.refresh_from_db()
+        assert recipe2.image_status == 'ready'
+        assert set(recipe2.renditions) == {'thumbnail', 'card', 'full'}
+        assert 'Обработано 1 рецептов, с ошибками 0.' in (
+            capsys.readouterr().out)
+
+    def test_process_in_pool(self, recipe):
+        """Копии строятся в пуле процессов."""
+        call_command('process_images', once=True, workers=1, all=True)
+        recipe.refresh_from_db()
+        assert recipe.image_status == 'ready'
+        storage = recipe.image.storage
+        assert all(
+            storage.exists(path) for path in recipe.renditions.values())
+
+    def test_regenerate_all(self, recipe):
+        """Повторно построенные копии совпадают с прежними файлами."""
+        old = generate_renditions(recipe)
+        call_command('process_images', once=True, workers=0, all=True)
+        recipe.refresh_from_db()
+        storage = recipe.image.storage
+        assert recipe.image_status == 'ready'
+        assert recipe.renditions == old
+        assert all(storage.exists(path) for path in old.values())
+
+    def test_broken_image(self, recipe, capsys):
+        """Неразборчивое изображение отмечается ошибкой."""
+        with recipe.image.open('wb') as file:
+            file.write(b'not an image')
+        Recipe.objects.filter(pk=recipe.pk).update(image_status='pending')
+        call_command('process_images', once=True, workers=0, min_age=0)
+        recipe.refresh_from_db()
+        assert recipe.image_status == 'failed'
+        assert recipe.renditions == {}
+
+    def test_pool_recovery(self, recipe, settings):
+        """
+        В режиме pool обрабатываются только рецепты, ожидающие дольше
+        IMAGE_PENDING_TIMEOUT: более новые еще в пуле веб-сервера.
+        """
+        settings.IMAGE_PROCESSING = 'pool'
+        settings.IMAGE_PENDING_TIMEOUT = 300
+        pending = Recipe.objects.filter(pk=recipe.pk)
+        pending.update(image_status='pending')
+        call_command('process_images', once=True, workers=0)
+        recipe.refresh_from_db()
+        assert recipe.image_status == 'pending'
+        pending.update(
+            updated_at=timezone.now() - timedelta(seconds=301))
+        call_command('process_images', once=True, workers=0)
+        recipe.refresh_from_db()
+        assert recipe.image_status == 'ready'
+
+
+class TestCleanupMedia:
+    """Тесты команды cleanup_media."""
+
+    def test_remove_orphans(self, recipe, capsys):
+        """Удаляются только файлы без ссылок из рецептов."""
+        storage = recipe.image.storage
+        generate_renditions(recipe)
+        orphan = storage.save('orphan.png', ContentFile(b'orphan'))
+        call_command('cleanup_media', min_age=0, dry_run=True)
+        assert storage.exists(orphan)
+        assert f'{orphan}\n' in capsys.readouterr().out
+        call_command('cleanup_media', min_age=0)
+        assert not storage.exists(orphan)
+        assert storage.exists(recipe.image.name)
+        assert all(
+            storage.exists(path) for path in recipe.renditions.values())
+        assert 'Удалено 1 файлов, 6 байт.' in capsys.readouterr().out
+
+    def test_keep_recent_files(self, recipe):
+        """Недавно созданные файлы не удаляются."""
+        storage = recipe.image.storage
+        orphan = storage.save('orphan.png', ContentFile(b'orphan'))
+        call_command('cleanup_media')
+        assert storage.exists(orphan)
+
+
+class TestSeedData:
+    """Тесты команды seed_data."""
+
+    @pytest.fixture
+    def catalog(self, tag, tag2, ingredient, ingredient2):
+        """Справочники, из которых строятся рецепты."""
+
+    @staticmethod
+    def snapshot():
+        """Созданные данные без учета id."""
+        recipes = [
+            (recipe.name, recipe.text, recipe.author.username,
+             sorted(tag.slug for tag in recipe.tags.all()),
+             sorted((amount.ingredient.name, amount.amount)
+                    for amount in recipe.amounts.all()))
+            for recipe in Recipe.objects.order_by('id')
+        ]
+        follows = sorted(Follow.objects.values_list(
+            'user__username', 'author__username'))
+        favorites = sorted(RecipesFavorite.objects.values_list(
+            'user__username', 'recipe__name'))
+        return recipes, follows, favorites
+
+    def test_seed(self, catalog, capsys):
+        """Данные создаются согласованными с масками, счетчиками и поиском."""
+        call_command('seed_data', users=20, recipes=60, seed=3,
+                     batch_size=7, password='secret')
+        out = capsys.readouterr().out
+        assert 'Создано 20 пользователей.' in out
+        assert 'Создано 60 рецептов.' in out
+        assert User.objects.filter(username__startswith='user3_').count() == 20
+        assert Recipe.objects.count() == 60
+        assert ShoppingCart.objects.exists()
+        for recipe in Recipe.objects.prefetch_related('tags', 'amounts'):
+            assert recipe.tags_mask == sum(
+                tag.mask for tag in recipe.tags.all())
+            assert 1 <= len(recipe.amounts.all()) <= 2
+        call_command('recalculate_counters')
+        out = capsys.readouterr().out
+        assert out.count('исправлено 0 записей.') == len(out.splitlines())
+        recipe = Recipe.objects.first()
+        assert search_recipes(
+            Recipe.objects.all(), recipe.name.split(':')[0]).exists()
+        assert User.objects.get(username='user3_0').check_password('secret')
+
+    def test_deterministic(self, catalog):
+        """С одинаковым --seed создаются одинаковые данные."""
+        call_command('seed_data', users=10, recipes=30, seed=5)
+        first = self.snapshot()
+        User.objects.filter(username__startswith='user5_').delete()
+        call_command('seed_data', users=10, recipes=30, seed=5)
+        assert self.snapshot() == first
+        with pytest.raises(CommandError):
+            call_command('seed_data', users=10, recipes=30, seed=5)
+
+    def test_unique_passwords(self, catalog):
+        """Свои пароли пользователей хешируются в пуле процессов."""
+        call_command('seed_data', users=2, recipes=0, seed=7,
+                     unique_passwords=True, password='secret', workers=2)
+        assert User.objects.get(username='user7_1').check_password('secret1')
+
+    def test_requires_catalog(self):
+        """Без ингредиентов и тегов команда завершается ошибкой."""
+        with pytest.raises(CommandError):
+            call_command('seed_data', users=1, recipes=1)
@@ -1,8 +1,13 @@
 """Тесты моделей приложения recipes и users."""
 
+import hashlib
+import os
+import time
+
 import pytest
 
 from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
 from django.core.validators import MinValueValidator
 from django.db import IntegrityError
 
@@ -225,6 +230,40 @@ class TestTagModel:
         )
         assert tag2.id != tag.id
 
+    def test_masks_assigned(self, tag, tag2):
+        """Каждому тегу назначается свой бит маски."""
+        assert {tag.mask, tag2.mask} == {1, 2}
+        tag.delete()
+        tag3 = Tag.objects.create(name='Обед', color='#0000FF', slug='lunch')
+        assert tag3.mask == 1
+
+    def test_masks_limit(self):
+        """Больше Tag.MAX_TAGS тегов создать нельзя."""
+        tags = [Tag(name=f'Тег {i}', color='#FF0000', slug=f'tag-{i}')
+                for i in range(Tag.MAX_TAGS)]
+        Tag.assign_masks(tags)
+        Tag.objects.bulk_create(tags)
+        with pytest.raises(ValueError):
+            Tag.objects.create(name='Лишний', color='#FF0000', slug='extra')
+
+    def test_recipe_tags_mask(self, recipe, tag, tag2):
+        """Маска тегов рецепта следует за изменением его тегов."""
+        recipe.refresh_from_db()
+        assert recipe.tags_mask == tag.mask
+        recipe.tags.add(tag2)
+        recipe.refresh_from_db()
+        assert recipe.tags_mask == tag.mask | tag2.mask
+        tag2.recipes.remove(recipe)
+        recipe.refresh_from_db()
+        assert recipe.tags_mask == tag.mask
+        tag.recipes.clear()
+        recipe.refresh_from_db()
+        assert recipe.tags_mask == 0
+        recipe.tags.set([tag, tag2])
+        tag.delete()
+        recipe.refresh_from_db()
+        assert recipe.tags_mask == tag2.mask
+
     def test_slug_validation_invalid_spaces(self):
         """Проверка валидации slug с пробелами."""
         tag = Tag(name='Tets', color='#FF0000', slug='invalid slug')
@@ -377,6 +416,86 @@ class TestRecipeModel:
         assert min_validator.limit_value == 1
 
 
+class TestRecipeImageStorage:
+    """Тесты хранения изображений рецептов по хешу содержимого."""
+
+    def test_hashed_name(self, recipe):
+        """Имя файла - хеш содержимого в подкаталогах."""
+        with recipe.image.open('rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        assert recipe.image.name == f'{digest[:2]}/{digest[2:4]}/{digest}.png'
+
+    def test_same_image_stored_once(self, recipe, recipe2):
+        """Одинаковые изображения разных рецептов хранятся одним файлом."""
+        assert recipe.image.name == recipe2.image.name
+
+    def test_file_references(self, recipe):
+        """Ссылки рецепта на файлы следуют за заменой изображения."""
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        assert set(recipe.files.values_list('name', flat=True)) == {
+            recipe.image.name}
+        recipe.image = ContentFile(b'new image', name='new.png')
+        recipe.save()
+        assert set(recipe.files.values_list('name', flat=True)) == {
+            recipe.image.name}
+
+    def test_release_on_delete(
+            self, recipe, recipe2, settings,
+            django_capture_on_commit_callbacks):
+        """Файл удаляется вместе с последним ссылающимся рецептом."""
+        settings.MEDIA_ORPHAN_MIN_AGE = 0
+        storage = recipe.image.storage
+        name = recipe.image.name
+        with django_capture_on_commit_callbacks(execute=True):
+            recipe.delete()
+        assert storage.exists(name)
+        with django_capture_on_commit_callbacks(execute=True):
+            recipe2.delete()
+        assert not storage.exists(name)
+
+    def test_release_on_replace(
+            self, recipe, settings, django_capture_on_commit_callbacks):
+        """После замены изображения старый файл удаляется."""
+        settings.MEDIA_ORPHAN_MIN_AGE = 0
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        storage = recipe.image.storage
+        old = recipe.image.name
+        with django_capture_on_commit_callbacks(execute=True):
+            recipe.image = ContentFile(b'new image', name='new.png')
+            recipe.save()
+        assert not storage.exists(old)
+        assert storage.exists(recipe.image.name)
+
+    def test_release_keeps_recent_file(
+            self, recipe, django_capture_on_commit_callbacks):
+        """
+        Недавно сохраненный файл не удаляется: на него может ссылаться
+        рецепт из незафиксированной транзакции.
+        """
+        storage = recipe.image.storage
+        name = recipe.image.name
+        with django_capture_on_commit_callbacks(execute=True):
+            recipe.delete()
+        assert storage.exists(name)
+
+    def test_save_existing_file_renews_it(
+            self, recipe, settings, django_capture_on_commit_callbacks):
+        """
+        Повторное сохранение существующего файла защищает его
+        от удаления при одновременном освобождении.
+        """
+        settings.MEDIA_ORPHAN_MIN_AGE = 60
+        storage = recipe.image.storage
+        name = recipe.image.name
+        stale = time.time() - 120
+        os.utime(storage.path(name), (stale, stale))
+        with recipe.image.open('rb') as file:
+            assert storage.save('copy.png', ContentFile(file.read())) == name
+        with django_capture_on_commit_callbacks(execute=True):
+            recipe.delete()
+        assert storage.exists(name)
+
+
 class TestIngredientInRecipe:
     """Тесты связи ингредиента и рецепта."""
 
@@ -0,0 +1,224 @@
+"""
+Тесты планов горячих запросов.
+
+Каждый запрос, который выполняют списки рецептов, фильтры, подписки
+и выгрузка списка покупок, прогоняется через EXPLAIN на заполненной
+базе. Тест падает, если план читает таблицу или индекс целиком:
+SCAN без условия поиска в SQLite, Seq Scan или Index Scan без
+Index Cond в PostgreSQL.
+
+Допускаются только два вида обхода без условия:
+- обход индекса в порядке ORDER BY запроса без WHERE с LIMIT - он
+  останавливается после LIMIT строк (первая страница списка);
+- COUNT(*) всей таблицы - его нельзя получить без обхода, поэтому
+  CachedCountPaginator кеширует количество, а на PostgreSQL
+  использует оценку планировщика.
+"""
+import json
+import re
+
+import pytest
+import sqlparse
+from django.db import connection
+from sqlparse.sql import Where
+from sqlparse.tokens import Keyword
+
+from recipes.models import RecipesFavorite, ShoppingCart
+from users.models import Follow
+
+pytestmark = pytest.mark.django_db
+
+USERS = 20
+RECIPES_PER_USER = 15
+AMOUNTS_PER_RECIPE = 5
+SQLITE_SCAN_RE = re.compile(r'^SCAN (\S+)(?: (.*))?$')
+# Обход виртуальной таблицы FTS5 с условием MATCH.
+SQLITE_VIRTUAL_SEARCH_RE = re.compile(r'^VIRTUAL TABLE INDEX \d+:\S+$')
+SQLITE_INDEX_WALK_RE = re.compile(r'^USING (?:COVERING )?INDEX \S+$')
+
+
+def is_limited_walk(sql):
+    """Запрос без WHERE верхнего уровня, ограниченный LIMIT."""
+    tokens = sqlparse.parse(sql)[0].tokens
+    return (
+        not any(isinstance(token, Where) for token in tokens)
+        and any(token.ttype is Keyword and token.normalized == 'LIMIT'
+                for token in tokens)
+    )
+
+
+def is_table_count(sql):
+    """Запрос COUNT(*) всей таблицы без условий."""
+    tokens = [
+        token for token in sqlparse.parse(sql)[0].tokens
+        if not token.is_whitespace
+    ]
+    return (
+        len(tokens) == 4
+        and tokens[1].normalized.upper().startswith('COUNT(*)')
+        and tokens[2].normalized == 'FROM'
+    )
+
+
+def full_scans(sql, params):
+    """Возвращает таблицы, которые план запроса читает целиком."""
+    if is_table_count(sql):
+        return []
+    limited = is_limited_walk(sql)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # На маленькой базе последовательное чтение дешевле любого
+            # индекса, поэтому планировщик выбирает его только тогда,
+            # когда подходящего индекса нет.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            nodes, tables = [plan[0]['Plan']], []
+            while nodes:
+                node = nodes.pop()
+                if node['Node Type'] == 'Seq Scan' or (
+                        node['Node Type'] in ('Index Scan', 'Index Only Scan')
+                        and 'Index Cond' not in node and not limited):
+                    tables.append(node['Relation Name'])
+                nodes.extend(node.get('Plans', ()))
+            return tables
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        plan = cursor.fetchall()
+    sorted_by_walk = not any(
+        detail.startswith('USE TEMP B-TREE FOR') for *_, detail in plan)
+    # Промежуточные результаты подзапросов SQLite тоже обходит SCAN.
+    tables = connection.introspection.table_names()
+    scans = []
+    for *_, detail in plan:
+        match = SQLITE_SCAN_RE.match(detail)
+        if not match or match.group(1) not in tables:
+            continue
+        access = match.group(2) or ''
+        if SQLITE_VIRTUAL_SEARCH_RE.match(access) or (
+                SQLITE_INDEX_WALK_RE.match(access)
+                and limited and sorted_by_walk):
+            continue
+        scans.append(match.group(1))
+    return scans
+
+
+@pytest.fixture
+def seeded(user, seed_recipes):
+    """Заполненная база: авторы, рецепты, подписки, избранное, корзины."""
+    data = seed_recipes(USERS, RECIPES_PER_USER, tags_count=5,
+                        ingredients_count=50, amounts=AMOUNTS_PER_RECIPE)
+    authors, recipes = data.authors, data.recipes
+    for reader in (user, *authors[:5]):
+        Follow.objects.bulk_create(
+            Follow(user=reader, author=author) for author in authors[5:15])
+        RecipesFavorite.objects.bulk_create(
+            RecipesFavorite(user=reader, recipe=recipe)
+            for recipe in recipes[::7])
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=reader, recipe=recipe)
+            for recipe in recipes[::11])
+    return {'authors': authors, 'tags': data.tags, 'recipes': recipes}
+
+
+class TestHotQueryPlans:
+    """Горячие запросы API не читают таблицы целиком."""
+
+    @staticmethod
+    def assert_no_full_scans(client, url, params=None):
+        queries = []
+
+        def record(execute, sql, query_params, many, context):
+            if sql.lstrip().upper().startswith('SELECT'):
+                queries.append((sql, query_params))
+            return execute(sql, query_params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = client.get(url, params)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        assert response.status_code == 200
+        assert queries
+        for sql, query_params in queries:
+            assert not full_scans(sql, query_params), sql
+
+    @pytest.mark.parametrize('sql, params', [
+        ('SELECT id FROM recipes_recipe WHERE text = %s', ['Описание']),
+        ('SELECT id FROM recipes_recipe WHERE (tags_mask & %s) > 0 '
+         'ORDER BY pub_date DESC, id DESC LIMIT 6', [1]),
+        ('SELECT COUNT(*) FROM recipes_recipe WHERE pub_date IS NOT NULL',
+         []),
+        ('SELECT id FROM recipes_recipe ORDER BY pub_date DESC, id DESC',
+         []),
+    ])
+    def test_full_scan_detected(self, seeded, sql, params):
+        """
+        Запрос без подходящего индекса и обход индекса с отбором
+        или без LIMIT распознаются как полный обход.
+        """
+        assert full_scans(sql, params) == ['recipes_recipe']
+
+    @pytest.mark.parametrize('sql', [
+        'SELECT id FROM recipes_recipe ORDER BY pub_date DESC, id DESC '
+        'LIMIT 6',
+        'SELECT COUNT(*) FROM recipes_recipe',
+    ])
+    def test_bounded_walk_allowed(self, seeded, sql):
+        """Первая страница без отбора и количество всех строк."""
+        assert full_scans(sql, []) == []
+
+    @pytest.mark.parametrize('params', [
+        {},
+        {'limit': 6},
+        {'is_favorited': 1},
+        {'is_in_shopping_cart': 1},
+        {'tags_mode': 'any'},
+        {'tags_mode': 'all'},
+        {'search': 'рецепт'},
+    ])
+    def test_recipe_list(self, authenticated_client, seeded, params):
+        """Список рецептов с фильтрами пользователя."""
+        if 'tags_mode' in params:
+            params['tags'] = [tag.slug for tag in seeded['tags'][:2]]
+        self.assert_no_full_scans(
+            authenticated_client, '/api/recipes/', params)
+
+    def test_recipe_cursor_next_page(self, authenticated_client, seeded):
+        """Следующая страница в режиме курсора."""
+        response = authenticated_client.get(
+            '/api/recipes/', {'cursor': '', 'limit': 6})
+        self.assert_no_full_scans(
+            authenticated_client, response.data['next'])
+
+    def test_recipe_list_anonymous(self, api_client, seeded):
+        """Список рецептов для анонима."""
+        self.assert_no_full_scans(api_client, '/api/recipes/')
+
+    def test_recipe_list_by_author(self, authenticated_client, seeded):
+        """Рецепты автора."""
+        self.assert_no_full_scans(
+            authenticated_client, '/api/recipes/',
+            {'author': seeded['authors'][3].id})
+
+    def test_recipe_retrieve(self, authenticated_client, seeded):
+        """Страница рецепта."""
+        recipe = seeded['recipes'][42]
+        self.assert_no_full_scans(
+            authenticated_client, f'/api/recipes/{recipe.id}/')
+
+    def test_subscriptions(self, authenticated_client, seeded):
+        """Подписки с последними рецептами авторов."""
+        self.assert_no_full_scans(
+            authenticated_client, '/api/users/subscriptions/',
+            {'recipes_limit': 3})
+
+    def test_download_shopping_cart(self, authenticated_client, seeded):
+        """Выгрузка списка покупок."""
+        self.assert_no_full_scans(
+            authenticated_client, '/api/recipes/download_shopping_cart/')
+
+    def test_serve_media(self, api_client, seeded, recipe, settings):
+        """Проверка ссылки на медиафайл."""
+        settings.MEDIA_ACCEL_REDIRECT = True
+        self.assert_no_full_scans(api_client, f'/media/{recipe.image.name}')
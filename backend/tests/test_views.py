@@ -1,9 +1,14 @@
 """Тесты представлений приложений recipes и users."""
 
+import time
+from pathlib import Path
+
 import pytest
+from django.core.files.base import ContentFile
 from rest_framework import status
 
-from recipes.models import RecipesFavorite, ShoppingCart
+from recipes.cache import get_cache
+from recipes.models import Recipe, RecipesFavorite, ShoppingCart
 
 pytestmark = pytest.mark.django_db
 
@@ -171,3 +176,303 @@ class TestRecipeViewSetActions:
         )
         assert response.status_code == status.HTTP_200_OK
         assert response['Content-Type'] == 'text/csv'
+
+
+class TestReferenceCache:
+    """Тесты кеширования справочников тегов и ингредиентов."""
+
+    def test_tags_etag_not_modified(self, api_client, tag):
+        """Повторный запрос с ETag получает ответ 304."""
+        response = api_client.get('/api/tags/')
+        etag = response['ETag']
+        assert 'max-age' in response['Cache-Control']
+        response = api_client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_tags_cached_without_queries(
+            self, api_client, tag, django_assert_num_queries):
+        """Закешированный ответ не обращается к базе данных."""
+        api_client.get('/api/tags/')
+        with django_assert_num_queries(0):
+            response = api_client.get('/api/tags/')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data[0]['slug'] == tag.slug
+
+    def test_tags_cache_invalidated_on_save(self, api_client, tag):
+        """Изменение тега сбрасывает кеш и меняет ETag."""
+        response = api_client.get(f'/api/tags/{tag.id}/')
+        etag = response['ETag']
+        tag.name = 'Полдник'
+        tag.save()
+        response = api_client.get(
+            f'/api/tags/{tag.id}/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['name'] == 'Полдник'
+        assert response['ETag'] != etag
+
+    def test_ingredients_cache_keyed_by_query(
+            self, api_client, ingredient, ingredient2, settings):
+        """Ответы с разными параметрами кешируются отдельно."""
+        settings.INGREDIENT_SEARCH_BACKEND = 'db'
+        first = api_client.get('/api/ingredients/', {'name': 'Яйц'})
+        second = api_client.get('/api/ingredients/', {'name': 'Мол'})
+        assert first['ETag'] != second['ETag']
+        assert [item['name'] for item in second.data] == ['Молоко']
+
+
+class TestRecipeConditionalGet:
+    """Тесты условных запросов к рецептам."""
+
+    @pytest.fixture(autouse=True)
+    def conditional_get(self, settings):
+        """Тесты выполняются в одном процессе, поэтому кеш общий."""
+        settings.CONDITIONAL_GET = True
+
+    @staticmethod
+    def settle_versions():
+        """Сдвигает версии в прошлое, как будто данные давно не менялись."""
+        version = time.time_ns() - 10 * 10 ** 9
+        for namespace in ('recipes', 'users', 'tags', 'ingredients'):
+            get_cache().set(f'{namespace}:version', version, timeout=None)
+
+    def test_disabled_without_shared_cache(
+            self, api_client, recipe, settings):
+        """Без общего кеша ответы отдаются без валидаторов."""
+        settings.CONDITIONAL_GET = False
+        response = api_client.get(
+            f'/api/recipes/{recipe.id}/', HTTP_IF_NONE_MATCH='"x"')
+        assert response.status_code == status.HTTP_200_OK
+        assert 'ETag' not in response
+        assert 'Last-Modified' not in response
+
+    def test_admin_ingredient_change(
+            self, admin_client, api_client, recipe, ingredient):
+        """Изменение ингредиента рецепта в админке меняет ETag."""
+        etag = api_client.get(f'/api/recipes/{recipe.id}/')['ETag']
+        amount = recipe.amounts.first()
+        response = admin_client.post(
+            f'/admin/v1/recipes/ingredientinrecipe/{amount.pk}/change/',
+            {'ingredient': amount.ingredient_id, 'recipe': recipe.id,
+             'amount': amount.amount + 1})
+        assert response.status_code == status.HTTP_302_FOUND
+        response = api_client.get(
+            f'/api/recipes/{recipe.id}/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_recipe_list_etag_not_modified(self, api_client, recipe):
+        """Повторный запрос списка с ETag получает ответ 304."""
+        response = api_client.get('/api/recipes/')
+        etag = response['ETag']
+        response = api_client.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    @pytest.mark.parametrize('params', [{}, {'cursor': ''}, {'limit': 1}])
+    def test_recipe_list_not_modified_without_queries(
+            self, authenticated_client, recipe, params,
+            django_assert_num_queries):
+        """Ответ 304 на список не обращается к базе данных."""
+        etag = authenticated_client.get('/api/recipes/', params)['ETag']
+        with django_assert_num_queries(0):
+            response = authenticated_client.get(
+                '/api/recipes/', params, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_recipe_not_modified_without_queries(
+            self, api_client, recipe, django_assert_num_queries):
+        """Ответ 304 на рецепт не обращается к базе данных."""
+        etag = api_client.get(f'/api/recipes/{recipe.id}/')['ETag']
+        with django_assert_num_queries(0):
+            response = api_client.get(
+                f'/api/recipes/{recipe.id}/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_recipe_if_modified_since(self, api_client, recipe):
+        """Аноним получает 304 по If-Modified-Since."""
+        self.settle_versions()
+        response = api_client.get(f'/api/recipes/{recipe.id}/')
+        last_modified = response['Last-Modified']
+        response = api_client.get(
+            f'/api/recipes/{recipe.id}/',
+            HTTP_IF_MODIFIED_SINCE=last_modified)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_recipe_if_modified_since_after_delete(
+            self, api_client, recipe, recipe2):
+        """Удаление рецепта меняет Last-Modified списка."""
+        self.settle_versions()
+        last_modified = api_client.get('/api/recipes/')['Last-Modified']
+        recipe2.delete()
+        response = api_client.get(
+            '/api/recipes/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        assert response.status_code == status.HTTP_200_OK
+        assert [item['id'] for item in response.data['results']] == [
+            recipe.id]
+
+    def test_recipe_if_modified_since_after_tag_rename(
+            self, api_client, recipe, tag):
+        """Переименование тега меняет Last-Modified рецепта."""
+        self.settle_versions()
+        url = f'/api/recipes/{recipe.id}/'
+        last_modified = api_client.get(url)['Last-Modified']
+        tag.name = 'Полдник'
+        tag.save()
+        response = api_client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['tags'][0]['name'] == 'Полдник'
+
+    def test_recipe_no_last_modified_same_second(self, api_client, recipe):
+        """
+        Пока не прошла секунда последнего изменения, Last-Modified
+        не отдается: изменение в ту же секунду его бы не поменяло.
+        """
+        response = api_client.get(f'/api/recipes/{recipe.id}/')
+        assert 'ETag' in response
+        assert 'Last-Modified' not in response
+
+    def test_recipe_etag_changes_on_ingredient_update(
+            self, authenticated_client, recipe, tag, ingredient,
+            test_image_base64):
+        """Изменение ингредиентов рецепта меняет ETag."""
+        url = f'/api/recipes/{recipe.id}/'
+        etag = authenticated_client.get(url)['ETag']
+        data = {
+            'ingredients': [{'id': ingredient.id, 'amount': 7}],
+            'tags': [tag.id],
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'image': f'data:image/png;base64,{test_image_base64}',
+        }
+        authenticated_client.patch(url, data, format='json')
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['ingredients'][0]['amount'] == 7
+
+    def test_recipe_etag_changes_on_favorite(
+            self, authenticated_client, recipe):
+        """Добавление в избранное меняет ETag для пользователя."""
+        etag = authenticated_client.get('/api/recipes/')['ETag']
+        authenticated_client.post(f'/api/recipes/{recipe.id}/favorite/')
+        response = authenticated_client.get(
+            '/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'][0]['is_favorited'] is True
+
+    def test_recipe_etag_changes_on_favorites_swap(
+            self, authenticated_client, user2, recipe):
+        """Замена избранного с той же суммой id меняет ETag."""
+        recipes = [recipe] + [
+            Recipe.objects.create(author=user2, name=f'Рецепт {i}',
+                                  text='Описание', cooking_time=5)
+            for i in range(3)
+        ]
+        for item in (recipes[0], recipes[3]):
+            authenticated_client.post(f'/api/recipes/{item.id}/favorite/')
+        etag = authenticated_client.get('/api/recipes/')['ETag']
+        for item in (recipes[0], recipes[3]):
+            authenticated_client.delete(f'/api/recipes/{item.id}/favorite/')
+        for item in (recipes[1], recipes[2]):
+            authenticated_client.post(f'/api/recipes/{item.id}/favorite/')
+        response = authenticated_client.get(
+            '/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert {
+            item['id'] for item in response.data['results']
+            if item['is_favorited']
+        } == {recipes[1].id, recipes[2].id}
+
+    def test_recipe_etag_changes_on_follow(
+            self, authenticated_client, recipe2, user2):
+        """Подписка на автора меняет ETag для пользователя."""
+        url = f'/api/recipes/{recipe2.id}/'
+        etag = authenticated_client.get(url)['ETag']
+        authenticated_client.post(f'/api/users/{user2.id}/subscribe/')
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['author']['is_subscribed'] is True
+
+    def test_recipe_etag_changes_on_author_update(
+            self, api_client, recipe, user):
+        """Изменение профиля автора меняет ETag, а вход - нет."""
+        url = f'/api/recipes/{recipe.id}/'
+        etag = api_client.get(url)['ETag']
+        api_client.post('/api/auth/token/login/', {
+            'email': user.email, 'password': 'testpass123'})
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        user.last_name = 'Повар'
+        user.save()
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['author']['last_name'] == 'Повар'
+
+    def test_recipe_retrieve_missing(self, api_client):
+        """Несуществующий рецепт возвращает 404."""
+        response = api_client.get('/api/recipes/999/')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+class TestServeMedia:
+    """Тесты отдачи медиафайлов."""
+
+    def test_accel_redirect(self, client, recipe, settings):
+        """Файл рецепта передается nginx с заголовками immutable."""
+        settings.MEDIA_ACCEL_REDIRECT = True
+        response = client.get(f'/media/{recipe.image.name}')
+        assert response.status_code == status.HTTP_200_OK
+        assert response['X-Accel-Redirect'] == (
+            f'/protected-media/{recipe.image.name}')
+        assert response['Content-Type'] == 'image/png'
+        assert response['Cache-Control'] == (
+            'public, max-age=31536000, immutable')
+        assert response.content == b''
+
+    def test_serve_without_nginx(self, client, recipe, settings):
+        """Без nginx файл отдает Django."""
+        settings.MEDIA_ACCEL_REDIRECT = False
+        response = client.get(f'/media/{recipe.image.name}')
+        assert response.status_code == status.HTTP_200_OK
+        assert 'X-Accel-Redirect' not in response
+        with recipe.image.open('rb') as file:
+            assert b''.join(response.streaming_content) == file.read()
+
+    def test_legacy_name_not_immutable(self, client, recipe, settings):
+        """Файлы со старыми именами кешируются на MEDIA_MAX_AGE."""
+        settings.MEDIA_ACCEL_REDIRECT = True
+        storage = recipe.image.storage
+        with recipe.image.open('rb') as file:
+            Path(storage.path('legacy.png')).write_bytes(file.read())
+        recipe.image = 'legacy.png'
+        recipe.save(update_fields=['image'])
+        response = client.get('/media/legacy.png')
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Cache-Control'] == (
+            f'public, max-age={settings.MEDIA_MAX_AGE}')
+
+    @pytest.mark.parametrize('path', [
+        'orphan.png', '../manage.py', 'missing/file.png'])
+    def test_not_found(self, client, recipe, path):
+        """Файлы без рецепта и пути вне MEDIA_ROOT не отдаются."""
+        recipe.image.storage.save('orphan.png', recipe.image)
+        response = client.get(f'/media/{path}')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_unreferenced_file(self, client, recipe):
+        """Файл, на который не ссылается ни один рецепт, не отдается."""
+        name = recipe.image.storage.save(
+            'orphan.png', ContentFile(b'orphan'))
+        response = client.get(f'/media/{name}')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_single_query(
+            self, client, recipe, settings, django_assert_num_queries):
+        """Доступ к файлу проверяется одним запросом."""
+        settings.MEDIA_ACCEL_REDIRECT = True
+        with django_assert_num_queries(1):
+            response = client.get(f'/media/{recipe.image.name}')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_post_not_allowed(self, client, recipe):
+        """Медиафайлы доступны только на чтение."""
+        response = client.post(f'/media/{recipe.image.name}')
+        assert response.status_code == status.HTTP_405_METHOD_NOT_ALLOWED
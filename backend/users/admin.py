@@ -5,7 +5,8 @@ from users.models import Follow, User
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     """Класс настройки пользователей."""
-    list_display = ('id', 'username', 'email', 'first_name', 'last_name')
+    list_display = ('id', 'username', 'email', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count')
     search_fields = ('username', 'email')
     list_filter = ('username', 'email')
     empty_value_display = '-пусто-'
@@ -72,6 +72,10 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField('Активирован', default=True)
     is_staff = models.BooleanField('Администратор', default=False)
     is_superuser = models.BooleanField('Суперпользователь', default=False)
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов', default=0, editable=False)
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков', default=0, editable=False)
 
     objects = CustomUserManager()
 
@@ -104,6 +108,7 @@ class Follow(models.Model):
         on_delete=models.CASCADE,
         related_name='following',
         verbose_name='Автор',
+        db_index=False,
     )
 
     class Meta:
@@ -115,3 +120,7 @@ class Follow(models.Model):
                 name='unique follow',
             )
         ]
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
@@ -1,6 +1,12 @@
 from api.v1.pagination import CustomPagination
-from api.v1.serializers import CustomUserSerializer, FollowSerializer
+from api.v1.serializers import (CustomUserSerializer, FollowSerializer,
+                                get_recipes_limit)
+from django.db import transaction
+from django.db.models import Prefetch
 from djoser.views import UserViewSet
+from recipes.cache import bump_version, user_namespace
+from recipes.counters import change_counter
+from recipes.models import Recipe
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
@@ -48,7 +54,10 @@ class CustomUserViewSet(UserViewSet):
             serializer = FollowSerializer(
                 author, data=request.data, context={"request": request})
             serializer.is_valid(raise_exception=True)
-            Follow.objects.create(user=user, author=author)
+            with transaction.atomic():
+                Follow.objects.create(user=user, author=author)
+                change_counter(User, author.pk, 'followers_count', 1)
+            bump_version(user_namespace(user.pk))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
@@ -56,13 +65,14 @@ class CustomUserViewSet(UserViewSet):
                 return Response({'detail': 'Пользователь не авторизован'},
                                 status=status.HTTP_401_UNAUTHORIZED)
 
-            subscription = Follow.objects.filter(
-                user=user, author=author).first()
-            if not subscription:
-                return Response({'detail': 'Подписка не найдена'},
-                                status=status.HTTP_400_BAD_REQUEST)
-
-            subscription.delete()
+            with transaction.atomic():
+                deleted, _ = Follow.objects.filter(
+                    user=user, author=author).delete()
+                if not deleted:
+                    return Response({'detail': 'Подписка не найдена'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                change_counter(User, author.pk, 'followers_count', -1)
+            bump_version(user_namespace(user.pk))
             return Response({'detail': 'Успешная отписка'},
                             status=status.HTTP_204_NO_CONTENT)
 
@@ -74,7 +84,16 @@ class CustomUserViewSet(UserViewSet):
         """Метод для получения пользователей,
         на которых подписан текущий пользователь."""
         user = request.user
-        queryset = User.objects.filter(following__user=user)
+        recipes = Recipe.objects.all()
+        limit = get_recipes_limit(request)
+        if limit is not None:
+            recipes = recipes[:limit]
+        queryset = (
+            User.objects.filter(following__user=user)
+            .prefetch_related(
+                Prefetch('recipes', queryset=recipes,
+                         to_attr='limited_recipes'))
+        )
         pages = self.paginate_queryset(queryset)
         serializer = FollowSerializer(
             pages, many=True, context={'request': request})